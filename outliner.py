@@ -5,96 +5,466 @@
  "  An easy way to synthesize notes into an essay outline.
 """ 
 
+# Taken before anything else is imported, to measure how long startup takes
+import time
+STARTED = time.time()
+
+import sys
+
+# With arguments, run the command-line interface instead of the GUI, before
+# anything that needs a display is imported
+if __name__ == "__main__" and len(sys.argv) > 1:
+    from outlinercli import main
+    sys.exit(main(sys.argv[1:]))
+
 from Tkinter import *
-from tkFileDialog import *
 from collections import deque
-import tkSimpleDialog
-import tkMessageBox
+from itertools import islice
+import importlib
+import os
 
+from outlinercompress import DEFAULT_LEVEL, LEVELS
 from outlinermodel import OutlinerModel
 from outlinergui import OutlinerGUI
+from outlinerio import IOExecutor
+from outlinerprofile import PROFILER, instrument, startFromEnvironment
+from outlinersession import Session
+from outlinerview import PerformanceWindow, SearchWindow
+
+class LazyModule():
+    """ Stands in for a module that is only imported when one of its
+        attributes is first used, so that dialog modules are not loaded
+        before the window appears. """
+
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+
+    def __getattr__(self, attribute):
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module, attribute)
+
+tkFileDialog = LazyModule("tkFileDialog")
+tkSimpleDialog = LazyModule("tkSimpleDialog")
+tkMessageBox = LazyModule("tkMessageBox")
 
 class Outliner():
 
-    def __init__(self, master=None):
+    def __init__(self, master=None, session=None,
+                 autosaveInterval=5 * 60 * 1000):
+        # session defaults to the one kept in the user's home directory
+        self.session = session if session is not None else Session()
+        # Path of the project being opened in the background, if any
+        self.loading = None
+        # Whether the last project is being reopened at startup
+        self.reopening = False
+        self.startupTime = None
         self.model = OutlinerModel(self)
         self.gui = OutlinerGUI(master, self, self.model)
+        self.io = IOExecutor(self.gui.root)
+        self.searchWindow = None
+        self.performanceWindow = None
+        # What to do with imported notes that repeat another note: 'merge' to
+        # drop them, 'flag' to keep and mark them, or None to keep them all
+        self.importDuplicates = 'flag'
+        # Milliseconds between checks of the project's note file for new notes
+        # while it is being followed, and the next check if one is scheduled
+        self.followInterval = 2000
+        self.followJob = None
+        self.gui.root.bind("<Control-f>", lambda event: self.searchNotes())
+
+        # Milliseconds between autosaves of a project that has a file, or None
+        self.autosaveInterval = autosaveInterval
+        if self.autosaveInterval is not None:
+            self.gui.root.after(self.autosaveInterval, self.autosave)
+
+        if self.session.reopenLast():
+            self.reopenLastProject()
+        self.gui.root.after_idle(self.reportStartup)
 
     """ ----------------------------------------------------------------- """
     """                            Menu methods                           """
     """ ----------------------------------------------------------------- """
 
+    def reportStartup(self):
+        """ Record the time from launch until the window could first be used,
+            and show it while the last project is still loading. """
+
+        self.gui.root.update_idletasks()
+        self.startupTime = time.time() - STARTED
+        if PROFILER.enabled:
+            PROFILER.add("Outliner.startup", self.startupTime)
+        if self.loading is not None:
+            self.gui.showStatus("Ready in %.2fs, loading %s..." %
+                                (self.startupTime, self.loading))
+
+    def reopenLastProject(self):
+        """ Open the last project in the background, showing its cached
+            preview at once if it has not changed since. """
+
+        projectPath = self.session.lastProject()
+        if projectPath is None:
+            return
+
+        preview = self.session.preview()
+        if preview is not None:
+            self.gui.showPreview(preview)
+        self.reopening = True
+        self.openProjectFile(projectPath)
+
+    def stillLoading(self):
+        """ Return True, after telling the user, if a project is still being
+            opened. """
+
+        if self.loading is not None:
+            self.gui.showStatus("Please wait, the project is still opening...")
+        return self.loading is not None
+
+    @instrument()
     def newProject(self):
         """ Create a new project. """
+
+        if self.stillLoading():
+            return
         
-        notepath = askopenfilename()
+        notepath = tkFileDialog.askopenfilename()
 
         if notepath is not None and notepath is not "":
-            self.model.newModel(notepath)
-            self.gui.displayNextNote()
+            self.importNotes(self.model.importNotes(
+                notepath, duplicates=self.importDuplicates))
+
+    @instrument()
+    def importFolder(self):
+        """ Add the notes in every note file in a folder to the project. """
 
+        if self.stillLoading():
+            return
+
+        folder = tkFileDialog.askdirectory()
+
+        if folder is not None and folder != "":
+            self.gui.showStatus("Importing notes from " + folder + "...")
+            self.importNotes(self.model.importFolder(
+                folder, duplicates=self.importDuplicates))
+
+    @instrument()
+    def importNotes(self, importer, batchsize=500):
+        """ Pull notes from importer a batch at a time, returning to the Tk
+            mainloop between batches so that the first notes can be displayed
+            while the rest of the file is still being read. """
+
+        count = sum(1 for note in islice(importer, batchsize))
+        self.gui.displayNextNote()
+
+        if count == batchsize:
+            self.gui.root.after_idle(self.importNotes, importer, batchsize)
+        elif len(self.model.importErrors) > 0:
+            self.gui.showStatus("Could not read %d files, such as %s" %
+                                (len(self.model.importErrors),
+                                 self.model.importErrors[0]))
+        elif self.model.mergedDuplicates > 0:
+            self.gui.showStatus("Merged %d duplicate notes" %
+                                self.model.mergedDuplicates)
+
+    def followSource(self, follow):
+        """ Start or stop adding the notes that are appended to the note file
+            of the project as they are written. Return False if the project
+            has no note file to follow. """
+
+        if follow and self.model.source is None:
+            self.gui.showStatus("This project has no note file to follow")
+            return False
+
+        if self.followJob is not None:
+            self.gui.root.after_cancel(self.followJob)
+            self.followJob = None
+        if follow:
+            self.pollSource()
+        return True
+
+    @instrument()
+    def pollSource(self):
+        """ Add any notes appended to the note file since it was last read,
+            then schedule the next check. """
+
+        if self.loading is None and self.model.source is not None:
+            try:
+                noteids = self.model.pollSource()
+            except IOError:
+                noteids = []
+            if len(noteids) > 0:
+                # The current note may be a note that was finished
+                self.gui.displayNextNote()
+                self.gui.showStatus("Added %d new notes from %s" %
+                                    (len(noteids),
+                                     os.path.basename(self.model.source['path'])))
+
+        self.followJob = self.gui.root.after(self.followInterval,
+                                             self.pollSource)
+
+    @instrument()
     def openProject(self):
-        """ Open a previous project from its .otln file. """
+        """ Open a previous project from its .otln or .otlb file. """
+
+        if self.stillLoading():
+            return
         
-        projectPath = askopenfilename(filetypes=[("Outliner files", "*.otln")])
+        projectPath = tkFileDialog.askopenfilename(
+            filetypes=[("Outliner files", "*.otln"),
+                       ("Indexed Outliner files", "*.otlb")])
 
         if projectPath is "":
             return
-        if projectPath[-5:] != ".otln":
+        if projectPath[-5:] not in (".otln", ".otlb"):
             errorPrompt = "I'm sorry, but that file is not a valid input " +\
-                "type.\nPlease choose a valid Outliner file (.otln)"
+                "type.\nPlease choose a valid Outliner file (.otln or .otlb)"
             tkMessageBox.showerror("Error: Invalid File Type", errorPrompt)
             return
 
-        self.model.openModel(projectPath)
-        self.gui.openGUI()
+        self.openProjectFile(projectPath)
+
+    def openProjectFile(self, projectPath):
+        """ Open the project at projectPath on the I/O thread. """
 
-    def saveProject(self):
-        """ Save the current state of the project. """
+        def openModel(report):
+            model = OutlinerModel(None)
+            model.openModel(projectPath)
+            return model
 
-        if self.model.filename is None:
+        self.loading = projectPath
+        self.gui.showStatus("Opening " + projectPath + "...")
+        self.io.submit(openModel, done=self.projectOpened)
+
+    @instrument()
+    def projectOpened(self, model, error):
+        """ Display the project once it has been read by the I/O thread. """
+
+        self.loading = None
+        self.gui.clearPreview()
+        if error is not None:
+            self.gui.displayNextNote()
+            self.ioFailed("open the project", error)
+            return
+
+        self.gui.closeProjectGUI()
+        self.model.adoptModel(model)
+        self.gui.openGUI()
+        self.gui.displayNextNote()
+        self.gui.showStatus("Opened " + self.model.filename)
+        self.session.remember(self.model)
+
+        if self.reopening:
+            self.reopening = False
+            loaded = time.time() - STARTED
+            if PROFILER.enabled:
+                PROFILER.add("Outliner.startupLoaded", loaded)
+            if self.startupTime is not None:
+                self.gui.showStatus("Opened %s: ready in %.2fs, loaded in "
+                                    "%.2fs" % (self.model.filename,
+                                               self.startupTime, loaded))
+
+    @instrument()
+    def saveProject(self, quiet=False):
+        """ Save the current state of the project. quiet skips a save with no
+            changes without saying so, as autosave does. """
+
+        if self.stillLoading():
+            return
+        elif self.model.filename is None:
             self.saveProjectAs()
         else:
-            self.model.saveModel()
+            save = self.model.prepareSave()
+            if save['kind'] == 'clean':
+                if not quiet:
+                    self.gui.showStatus("No changes to save")
+                return
+            self.io.submitSave(save['kind'],
+                               lambda report: self.model.writeSave(save, report),
+                               done=self.projectSaved,
+                               progress=self.showProgress("Saving"))
+
+    def projectSaved(self, result, error):
+        """ Report the end of a save on the I/O thread. """
+
+        if error is not None:
+            self.ioFailed("save the project", error)
+        else:
+            self.gui.showStatus("Saved " + self.model.filename)
+            self.session.remember(self.model)
+
+    def autosave(self):
+        """ Save a project that has a file, then schedule the next autosave.
+            Nothing is saved, or said, while a project is opening. """
 
+        if (self.loading is None and self.model.filename is not None and
+            self.model.filename != ""):
+            self.saveProject(quiet=True)
+        self.gui.root.after(self.autosaveInterval, self.autosave)
+
+    @instrument()
     def saveProjectAs(self):
         """ Save the project under a new name. """
         
         options = {}
         options['defaultextension'] = '.otln'
-        options['filetypes'] = [('all files', '.*'), ('Outliner files', '.otln')]
+        options['filetypes'] = [('all files', '.*'), ('Outliner files', '.otln'),
+                                ('Indexed Outliner files', '.otlb')]
         options['title'] = 'Save your outline'
 
-        self.model.filename = asksaveasfilename(**options)
+        self.model.filename = tkFileDialog.asksaveasfilename(**options)
 
         if self.model.filename is not "":
             self.saveProject()
 
+    def setCompression(self, compression):
+        """ Compress the project file with compression from the next save on,
+            or stop compressing it if compression is "none". The level is kept
+            if the new compression has it. """
+
+        if compression == "none":
+            compression = level = None
+        else:
+            level = self.model.compressionLevel
+            if level not in LEVELS[compression]:
+                level = None
+        self.model.setCompression(compression, level)
+
+        if (self.model.filename is not None and
+            self.model.filename.endswith(".otlb")):
+            self.gui.showStatus("Indexed projects are not compressed; save "
+                                "as .otln to compress")
+        elif compression is None:
+            self.gui.showStatus("The project will be saved uncompressed")
+        else:
+            self.gui.showStatus("The project will be saved with %s "
+                                "compression" % compression)
+
+    def chooseCompressionLevel(self):
+        """ Ask for the level at which to compress the project file, where
+            higher levels are smaller but slower to save. """
+
+        compression = self.model.compression
+        if compression is None:
+            self.gui.showStatus("Choose a compression first")
+            return
+
+        levels = LEVELS[compression]
+        level = self.model.compressionLevel
+        prompt = "%s compression level (%d fastest to %d smallest):" % (
+            compression, levels[0], levels[-1])
+        level = tkSimpleDialog.askinteger(
+            "Compression Level", prompt,
+            initialvalue=(DEFAULT_LEVEL[compression] if level is None
+                          else level),
+            minvalue=levels[0], maxvalue=levels[-1])
+        if level is not None:
+            self.model.setCompression(compression, level)
+            self.gui.showStatus("The project will be saved with %s "
+                                "compression at level %d" % (compression,
+                                                             level))
+
+    @instrument()
     def exportOutline(self):
-        """ Create a .txt outline based off of the notes in the Outliner. """
+        """ Create an outline based off of the notes in the Outliner, in the
+            format given by the extension of the file chosen. """
         
         options = {}
         options['defaultextension'] = '.txt'
-        options['filetypes'] = [('all files', '.*'), ('Text files', '.txt')]
-        options['title'] = 'Export your outline to a text file'
+        options['filetypes'] = [('all files', '.*'), ('Text files', '.txt'),
+                                ('Markdown files', '.md'),
+                                ('HTML files', '.html'),
+                                ('JSON lines files', '.jsonl')]
+        options['title'] = 'Export your outline'
         
-        exportpath = asksaveasfilename(**options)
+        if self.stillLoading():
+            return
+
+        exportpath = tkFileDialog.asksaveasfilename(**options)
 
         if exportpath is not "":
-            self.model.exportModel(exportpath)
+            export = self.model.prepareExport()
+            self.io.submit(lambda report: self.model.writeExport(exportpath,
+                                                                 export,
+                                                                 report),
+                           done=self.outlineExported,
+                           progress=self.showProgress("Exporting"))
+
+    def outlineExported(self, result, error):
+        """ Report the end of an export on the I/O thread. """
+
+        if error is not None:
+            self.ioFailed("export the outline", error)
+        else:
+            self.gui.showStatus("Exported outline")
+
+    def showProgress(self, action):
+        """ Return a callback that shows the progress of action. """
+
+        return (lambda fraction:
+                    self.gui.showStatus("%s... %d%%" % (action,
+                                                        fraction * 100)))
+
+    def ioFailed(self, action, error):
+        """ Report to the user that an I/O job failed. """
+
+        self.gui.showStatus("")
+        errorPrompt = "I'm sorry, but I could not %s.\n%s" % (action, error)
+        tkMessageBox.showerror("Error", errorPrompt)
+
+    def showPerformance(self):
+        """ Open the window showing where time is being spent, or bring it to
+            the front. """
+
+        if self.performanceWindow is None:
+            self.performanceWindow = PerformanceWindow(self, PROFILER)
+        else:
+            self.performanceWindow.lift()
 
     def quit(self):
-        """ Quit the outliner. """
+        """ Quit the outliner once pending saves have been written. """
 
+        self.io.finish()
         self.gui.root.quit()
 
+    @instrument()
+    def undo(self):
+        """ Undo the last change to the notes and topics. """
+
+        self.replayHistory(self.model.undo, "undo")
+
+    @instrument()
+    def redo(self):
+        """ Redo the last change that was undone. """
+
+        self.replayHistory(self.model.redo, "redo")
+
+    def replayHistory(self, replay, action):
+        """ Undo or redo a change with replay, once the changes waiting to
+            be flushed from the GUI have reached the model, and redraw what
+            it changed. """
+
+        if self.stillLoading():
+            return
+
+        self.gui.flushUpdates()
+        records = replay()
+        if records is None:
+            self.gui.showStatus("Nothing to %s" % action)
+        else:
+            self.gui.showChanges(records)
+
     """ ------------------------------------------------------------------ """
     """                            Topic methods                           """
     """ ------------------------------------------------------------------ """
 
+    @instrument()
     def newTopic(self):
         """ Create a new topic. """
 
+        if self.stillLoading():
+            return
+
         topicPrompt = "What would you like to call your new topic?"
         topicName = tkSimpleDialog.askstring("New Topic", topicPrompt)
 
@@ -116,26 +486,38 @@ class Outliner():
             " this outline.\nPlease select a different name."
         tkMessageBox.showerror("Error: Topic Already Exists", errorprompt)
 
+    @instrument()
     def viewTopic(self, topic):
         """ Display the notes that are part of the topic. """
 
         self.gui.viewTopic(topic)
 
+    @instrument()
     def sortTopics(self):
-        """ Assign numbers to topics according to the order in which they are
-            currently arranged. """
+        """ Bring the order of the topics in the model up to date with the
+            topic lines. Each dropped topic line has already been moved on
+            its own, so only drops still waiting to be flushed are left. """
 
-        ordered = self.gui.topicList.getOrdered()
-        for i in range(len(ordered)):
-            topic = ordered[i].widget.topic
-            topic['number'] = i
+        self.gui.flushUpdates()
 
+    @instrument()
     def addNoteToTopic(self, topic):
         """ Add the currently-displayed note to the topic. """
 
         if len(self.model.notes) > 0:
-            note = self.model.addNoteToTopic(topic)
-            self.gui.addNoteToGUI(topic, note)
+            noteid = self.model.addNoteToTopic(topic)
+            self.gui.addNoteToGUI(topic, noteid)
+            self.gui.updateTopicGUI(topic)
+            self.gui.displayNextNote()
+
+    @instrument()
+    def assignNotes(self, topic, noteids):
+        """ Add the unassigned notes with the given ids to the topic in one
+            pass. The GUI is redrawn once, when the Tk mainloop is next idle. """
+
+        if len(noteids) > 0:
+            self.model.assignNotes(topic, noteids)
+            self.gui.addNotesToGUI(topic, noteids)
             self.gui.updateTopicGUI(topic)
             self.gui.displayNextNote()
 
@@ -143,31 +525,151 @@ class Outliner():
     """                            Note methods                           """
     """ ----------------------------------------------------------------- """
 
+    @instrument()
     def nextNote(self):
         """ Display the next note in the list. """
 
         if len(self.model.notes) > 0:
-            self.model.notes.append(self.model.notes.popleft())
+            self.model.nextNote()
             self.gui.displayNextNote()
 
+    @instrument()
     def prevNote(self):
         """ Display the last note in the list. """
 
         if len(self.model.notes) > 0:
-            self.model.notes.appendleft(self.model.notes.pop())
+            self.model.prevNote()
+            self.gui.displayNextNote()
+
+    @instrument()
+    def goToNote(self):
+        """ Jump to an unassigned note by its number. """
+
+        count = len(self.model.notes)
+        if count == 0:
+            return
+
+        prompt = "Go to note number (1 to {:,}):".format(count)
+        number = tkSimpleDialog.askinteger("Go To Note", prompt,
+                                           initialvalue=(
+                                               self.model.notePosition() + 1),
+                                           minvalue=1, maxvalue=count)
+        if number is not None:
+            self.model.jumpToNote(number - 1)
+            self.gui.displayNextNote()
+
+    def suggestionEngine(self):
+        """ Return the model's topic suggestion engine, or None after telling
+            the user if it is not available. """
+
+        try:
+            return self.model.suggestionEngine()
+        except ImportError as error:
+            tkMessageBox.showerror("Error: Suggestions Unavailable",
+                                   str(error))
+            return None
+
+    @instrument()
+    def suggestTopic(self):
+        """ Suggest a topic for the currently-displayed note, and add the note
+            to it if the user accepts. """
+
+        if len(self.model.notes) == 0 or len(self.model.topics) == 0:
+            return
+        engine = self.suggestionEngine()
+        if engine is None:
+            return
+
+        for score, name in engine.suggest(self.model.notes[0]):
+            prompt = "Add this note to \"%s\"? (confidence %.2f)" % (name,
+                                                                   score)
+            if tkMessageBox.askyesno("Suggested Topic", prompt):
+                self.addNoteToTopic(self.model.topics[name])
+                return
+        self.gui.showStatus("No more suggestions for this note")
+
+    @instrument()
+    def bulkAssign(self):
+        """ Add every unassigned note whose best suggested topic scores at
+            least a confidence chosen by the user to that topic. """
+
+        if len(self.model.notes) == 0 or len(self.model.topics) == 0:
+            return
+        engine = self.suggestionEngine()
+        if engine is None:
+            return
+
+        prompt = "Assign notes whose best topic has at least this confidence " +\
+            "(0 to 1):"
+        threshold = tkSimpleDialog.askfloat("Bulk Assign", prompt,
+                                            initialvalue=0.5, minvalue=0.0,
+                                            maxvalue=1.0)
+        if threshold is None:
+            return
+
+        plan = engine.plan(list(self.model.notes), threshold)
+        count = sum(len(noteids) for noteids in plan.values())
+        prompt = "Assign %d notes to %d topics?" % (count, len(plan))
+        if count == 0 or not tkMessageBox.askyesno("Bulk Assign", prompt):
+            return
+
+        # The whole bulk assignment is undone in one step
+        self.model.history.begin()
+        try:
+            for name, noteids in plan.items():
+                self.assignNotes(self.model.topics[name], noteids)
+        finally:
+            self.model.history.end()
+        self.gui.showStatus("Assigned %d notes" % count)
+
+    @instrument()
+    def removeDuplicates(self):
+        """ Drop the unassigned notes that repeat another note, and flag the
+            duplicates that are already in topics. """
+
+        prompt = "Remove unassigned notes that repeat another note?"
+        if not tkMessageBox.askyesno("Remove Duplicates", prompt):
+            return
+
+        discarded, flagged = self.model.mergeDuplicates()
+        self.gui.displayNextNote()
+        self.gui.showStatus("Removed %d duplicate notes, %d duplicates in "
+                            "topics" % (discarded, flagged))
+
+    @instrument()
+    def searchNotes(self):
+        """ Open the window for searching notes, or bring it to the front. """
+
+        if self.searchWindow is None:
+            self.searchWindow = SearchWindow(self)
+        else:
+            self.searchWindow.lift()
+
+    @instrument()
+    def showNote(self, noteid):
+        """ Jump to the note with the given id: make it the current note if it
+            is unassigned, otherwise show it in its topic. """
+
+        name = self.model.searchIndex().location.get(noteid)
+        if name is None:
+            self.model.rotateToNote(noteid)
+            self.gui.returnToMain()
             self.gui.displayNextNote()
+        else:
+            self.gui.showNoteInTopic(self.model.topics[name], noteid)
 
+    @instrument()
     def sortNotes(self):
-        """ Sort the notes in each topic according to the order in which they 
-            are currently arranged. """
+        """ Bring the order of the notes in the model up to date with the
+            topics' DNDLists. Each dropped note has already been moved on its
+            own, so only drops still waiting to be flushed are left. """
         
-        for topic in self.model.topics.values():
-            topic['notes'] = [node.widget.cget('text')
-                              for node in topic['dndlist'].getOrdered()]
+        self.gui.flushUpdates()
 
 """ --------------------------------- main method ------------------------------- """
 
 if __name__ == "__main__":
+    startFromEnvironment()
     root = Tk()
     outliner = Outliner(root)
     root.mainloop()
@@ -0,0 +1,401 @@
+"""
+ "  File: outlinerbench.py
+ "  Written By: Gregory Owen
+ "
+ "  Benchmarks for the Outliner on synthetic note files and projects, with
+ "  results written as JSON so that they can be compared between commits
+ "
+ "  Usage: python outlinerbench.py run [options]
+ "         python outlinerbench.py generate [options] OUTPUT
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from outlinercompress import COMPRESSIONS, DEFAULT_LEVEL, LEVELS, available
+from outlinermodel import OutlinerModel
+
+def makeWords(count, rand):
+    """ Return a vocabulary of count made-up words. """
+
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rand.choice(letters) for i in range(rand.randint(2, 10)))
+            for j in range(count)]
+
+def generateNotes(path, notes, length, seed=0):
+    """ Write a note file of notes paragraphs of about length words each. """
+
+    rand = random.Random(seed)
+    words = makeWords(5000, rand)
+    outfile = open(path, 'w')
+    for i in range(notes):
+        size = max(1, int(rand.gauss(length, length / 4.0)))
+        outfile.write(" ".join(rand.choice(words) for j in range(size)))
+        outfile.write("\n\n")
+    outfile.close()
+
+def generateProject(path, notes, topics, length, assigned=0.8, seed=0):
+    """ Write a project of notes notes, the given fraction of which are spread
+        evenly over topics topics. The format is given by the extension of
+        path. """
+
+    notepath = path + ".notes"
+    generateNotes(notepath, notes, length, seed)
+
+    model = OutlinerModel(None)
+    model.newModel(notepath)
+    os.remove(notepath)
+
+    noteids = list(model.notes)[:int(notes * assigned)]
+    for i in range(topics):
+        topic = model.newTopic("Topic %d" % i)
+        model.assignNotes(topic, noteids[i::topics])
+
+    model.filename = path
+    model.saveModel()
+
+def timeRuns(func, repeat, setup=None):
+    """ Call func repeat times, calling setup before each call, and return the
+        time taken by each call. """
+
+    runs = []
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.time()
+        func()
+        runs.append(time.time() - start)
+    return runs
+
+class Benchmark():
+    """ Runs the benchmarks on synthetic projects of one size in a scratch
+        directory and collects the results. """
+
+    def __init__(self, workdir, notes, topics, length, repeat):
+        self.workdir = workdir
+        self.notes = notes
+        self.topics = topics
+        self.length = length
+        self.repeat = repeat
+        self.results = []
+
+    def path(self, name):
+        """ Return the path of a scratch file. """
+
+        return os.path.join(self.workdir, "%d-%s" % (self.notes, name))
+
+    def record(self, name, runs, variant=None, path=None):
+        """ Add the result of a benchmark to the results. """
+
+        result = {'benchmark': name, 'notes': self.notes,
+                  'topics': self.topics, 'length': self.length,
+                  'seconds': min(runs), 'runs': runs}
+        if variant is not None:
+            result['variant'] = variant
+        if path is not None:
+            result['bytes'] = os.path.getsize(path)
+        self.results.append(result)
+        print >>sys.stderr, "%-12s %-12s %7d notes  %.4fs%s" % (
+            name, variant or "", self.notes, min(runs),
+            "  %10d bytes" % result['bytes'] if 'bytes' in result else "")
+
+    def runModel(self):
+        """ Time creating, opening, saving and exporting a project. """
+
+        notepath = self.path("notes.txt")
+        generateNotes(notepath, self.notes, self.length)
+        self.record('newModel',
+                    timeRuns(lambda: OutlinerModel(None).newModel(notepath),
+                             self.repeat),
+                    path=notepath)
+
+        # The same notes spread over a folder of files, parsed serially and
+        # by one worker process per core
+        folder = self.path("folder")
+        os.mkdir(folder)
+        files = 100
+        for i in range(files):
+            generateNotes(os.path.join(folder, "notes%03d.txt" % i),
+                          self.notes / files, self.length, seed=i)
+        for processes, variant in ((1, 'serial'), (None, 'pool')):
+            self.record('importFolder',
+                        timeRuns(lambda: list(OutlinerModel(None).importFolder(
+                                     folder, processes)),
+                                 self.repeat),
+                        variant=variant)
+
+        projectpath = self.path("project.otln")
+        generateProject(projectpath, self.notes, self.topics, self.length)
+        model = OutlinerModel(None)
+        self.record('openModel',
+                    timeRuns(lambda: model.openModel(projectpath), self.repeat),
+                    variant='otln', path=projectpath)
+
+        # Saving under a new name always writes the whole project
+        for extension in (".otln", ".otlb"):
+            paths = [self.path("save%d%s" % (i, extension)) for i in range(2)]
+            runs = []
+            for i in range(self.repeat):
+                model.filename = paths[i % 2]
+                runs.extend(timeRuns(model.saveModel, 1))
+            self.record('saveModel', runs, variant=extension[1:],
+                        path=paths[0])
+
+        indexedpath = self.path("save0.otlb")
+        self.record('openModel',
+                    timeRuns(lambda: OutlinerModel(None).openModel(indexedpath),
+                             self.repeat),
+                    variant='otlb', path=indexedpath)
+
+        # Compressed snapshots trade save and open time for size; their bytes
+        # and times can be compared with the plain otln variants above
+        for compression in COMPRESSIONS:
+            if not available(compression):
+                continue
+            for level in sorted(set([LEVELS[compression][0],
+                                     DEFAULT_LEVEL[compression], 9])):
+                variant = "otln-%s-%d" % (compression, level)
+                model.setCompression(compression, level)
+                paths = [self.path("save%d-%s.otln" % (i, variant))
+                         for i in range(2)]
+                runs = []
+                for i in range(self.repeat):
+                    model.filename = paths[i % 2]
+                    runs.extend(timeRuns(model.saveModel, 1))
+                self.record('saveModel', runs, variant=variant, path=paths[0])
+                self.record('openModel',
+                            timeRuns(lambda: OutlinerModel(None).openModel(
+                                         paths[0]),
+                                     self.repeat),
+                            variant=variant, path=paths[0])
+        model.setCompression(None)
+
+        # A save after a small change only appends to the journal
+        model.openModel(projectpath)
+        model.saveModel()
+        self.record('saveModel',
+                    timeRuns(model.saveModel, self.repeat, setup=model.nextNote),
+                    variant='journal')
+
+        # Dragging a note or a topic moves just that note or topic
+        topic = max(model.topics.values(), key=model.noteCount)
+        model.loadTopic(topic)
+        rand = random.Random(0)
+        moves = [(rand.choice(topic['notes']),
+                  rand.randrange(len(topic['notes']))) for i in range(1000)]
+        self.record('moveNote',
+                    timeRuns(lambda: [model.moveNote(topic, noteid, index)
+                                      for noteid, index in moves],
+                             self.repeat),
+                    variant='1000 moves')
+        topics = model.orderedTopics()
+        self.record('moveTopic',
+                    timeRuns(lambda: [model.moveTopic(
+                                          rand.choice(topics),
+                                          rand.randrange(len(topics)))
+                                      for i in range(1000)],
+                             self.repeat),
+                    variant='1000 moves')
+
+        for format in ('txt', 'html'):
+            exportpath = self.path("outline." + format)
+            self.record('exportModel',
+                        timeRuns(lambda: model.exportModel(exportpath, format),
+                                 self.repeat),
+                        variant=format, path=exportpath)
+
+    def runGUI(self):
+        """ Time building the main screen for a generated project, whose notes
+            were assigned to topics through the model, viewing its largest
+            topic for the first time, and sorting notes when no drops are
+            waiting to be flushed. """
+
+        from Tkinter import Tk
+        from outliner import Outliner
+        from outlinersession import Session
+
+        projectpath = self.path("project.otln")
+        if not os.path.exists(projectpath):
+            generateProject(projectpath, self.notes, self.topics, self.length)
+
+        runs = {'openGUI': [], 'viewTopic': [], 'sortNotes': []}
+        for i in range(self.repeat):
+            root = Tk()
+            # A session of its own keeps the user's last project from being
+            # reopened or replaced, and autosave is off so it cannot write
+            # the project while it is timed
+            outliner = Outliner(root, Session(self.path("session.json")),
+                                autosaveInterval=None)
+            outliner.model.openModel(projectpath)
+            gui = outliner.gui
+
+            start = time.time()
+            gui.openGUI()
+            root.update()
+            runs['openGUI'].append(time.time() - start)
+
+            topic = max(outliner.model.topics.values(),
+                        key=outliner.model.noteCount)
+            start = time.time()
+            gui.viewTopic(topic)
+            root.update()
+            runs['viewTopic'].append(time.time() - start)
+
+            start = time.time()
+            outliner.sortNotes()
+            runs['sortNotes'].append(time.time() - start)
+
+            outliner.io.finish()
+            root.destroy()
+
+        for name in ('openGUI', 'viewTopic', 'sortNotes'):
+            self.record(name, runs[name])
+
+def startVirtualDisplay():
+    """ Start Xvfb if there is no display to run the GUI on. Return the Xvfb
+        process, or None if a display was already available. """
+
+    if os.environ.get('DISPLAY'):
+        return None
+
+    devnull = open(os.devnull, 'w')
+    for number in range(99, 120):
+        if os.path.exists("/tmp/.X%d-lock" % number):
+            continue
+        try:
+            process = subprocess.Popen(["Xvfb", ":%d" % number, "-screen",
+                                        "0", "1024x768x24", "-nolisten",
+                                        "tcp"],
+                                       stdout=devnull, stderr=devnull)
+        except OSError:
+            raise OSError("no display, and Xvfb is not installed")
+        time.sleep(1)
+        if process.poll() is None:
+            os.environ['DISPLAY'] = ":%d" % number
+            return process
+    raise OSError("could not start Xvfb")
+
+def gitCommit():
+    """ Return the commit of the working tree, or None outside of git. """
+
+    try:
+        devnull = open(os.devnull, 'w')
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=devnull,
+            cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def runBenchmarks(args):
+    """ Run the benchmarks for each size and return the report. """
+
+    report = {'commit': gitCommit(), 'time': time.time(),
+              'python': platform.python_version(),
+              'platform': platform.platform(), 'results': []}
+
+    display = None
+    if args.gui:
+        try:
+            display = startVirtualDisplay()
+        except OSError as error:
+            report['gui'] = "skipped: %s" % error
+            args.gui = False
+
+    workdir = tempfile.mkdtemp(prefix="outlinerbench")
+    try:
+        for notes in args.notes:
+            benchmark = Benchmark(workdir, notes, args.topics, args.length,
+                                  args.repeat)
+            benchmark.runModel()
+            if args.gui:
+                try:
+                    benchmark.runGUI()
+                except ImportError as error:
+                    report['gui'] = "skipped: %s" % error
+                    args.gui = False
+            report['results'].extend(benchmark.results)
+    finally:
+        shutil.rmtree(workdir)
+        if display is not None:
+            display.terminate()
+
+    return report
+
+def sizes(text):
+    """ Parse a comma-separated list of note counts. """
+
+    return [int(size) for size in text.split(",")]
+
+def makeParser():
+    """ Return the parser for the command line. """
+
+    parser = argparse.ArgumentParser(
+        prog="outlinerbench",
+        description="Benchmark the Outliner on synthetic projects.")
+    commands = parser.add_subparsers(dest="command")
+
+    run = commands.add_parser("run", help="run the benchmarks")
+    run.add_argument("--notes", type=sizes, default=[1000, 10000],
+                     help="comma-separated numbers of notes to benchmark "
+                          "(default: 1000,10000)")
+    run.add_argument("--topics", type=int, default=20,
+                     help="number of topics (default: 20)")
+    run.add_argument("--length", type=int, default=30,
+                     help="average number of words per note (default: 30)")
+    run.add_argument("--repeat", type=int, default=3,
+                     help="times to run each benchmark; the fastest run is "
+                          "reported (default: 3)")
+    run.add_argument("--gui", action="store_true",
+                     help="also benchmark the GUI, under Xvfb if there is no "
+                          "display")
+    run.add_argument("-o", "--output", default="-",
+                     help="file to write the JSON results to (default: "
+                          "standard output)")
+
+    generate = commands.add_parser("generate",
+                                   help="write a synthetic note file or "
+                                        "project")
+    generate.add_argument("--notes", type=int, default=10000)
+    generate.add_argument("--topics", type=int, default=20,
+                          help="number of topics; 0 writes a note file")
+    generate.add_argument("--length", type=int, default=30)
+    generate.add_argument("--seed", type=int, default=0)
+    generate.add_argument("output",
+                          help="file to write: a note file if --topics is 0, "
+                               "otherwise a .otln or .otlb project")
+
+    return parser
+
+def main(argv=None):
+    """ Run the command line, return the exit status. """
+
+    args = makeParser().parse_args(argv)
+
+    if args.command == 'generate':
+        if args.topics == 0:
+            generateNotes(args.output, args.notes, args.length, args.seed)
+        else:
+            generateProject(args.output, args.notes, args.topics, args.length,
+                            seed=args.seed)
+        return 0
+
+    report = runBenchmarks(args)
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        outfile = open(args.output, 'w')
+        json.dump(report, outfile, indent=2)
+        outfile.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,281 @@
+"""
+ "  File: outlinerbinary.py
+ "  Written By: Gregory Owen
+ "
+ "  Indexed binary project format (.otlb), whose topics can be decoded one at
+ "  a time from a memory-mapped file
+"""
+
+import json
+import mmap
+import os
+import struct
+import threading
+
+from outlinerjournal import replaceFile
+
+"""
+Layout of a .otlb file (all integers big-endian):
+  header:  magic "OTLB", format version (H), number of topics (I)
+  notes:   block of the unassigned notes
+  index:   for each topic, the length of its name (H), its name in UTF-8, then
+           its number (I) and its block
+  meta:    the length of a JSON object (I) followed by the object in UTF-8,
+           holding settings of the project such as its source note file
+           (version 2 and later)
+  blocks:  the notes of the unassigned deque and of each topic, each note
+           stored as its length (I) followed by its text in UTF-8
+
+A block is stored in the header and index as the number of notes in it (I),
+its offset from the start of the file (Q) and its length in bytes (Q).
+"""
+
+MAGIC = "OTLB"
+VERSION = 2
+# Versions that can still be read
+VERSIONS = (1, 2)
+
+HEADER = struct.Struct(">4sHI")
+NAME = struct.Struct(">H")
+NUMBER = struct.Struct(">I")
+BLOCK = struct.Struct(">IQQ")
+NOTE = struct.Struct(">I")
+
+def isBinaryProject(path):
+    """ Return True if the file at path is an indexed binary project. """
+
+    infile = open(path, 'rb')
+    magic = infile.read(len(MAGIC))
+    infile.close()
+    return magic == MAGIC
+
+def encodeText(text):
+    """ Return text as UTF-8 bytes. """
+
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return text
+
+def writeBlock(outfile, notes):
+    """ Write notes to outfile as a block, return the length of the block. """
+
+    length = 0
+    for note in notes:
+        data = encodeText(note)
+        outfile.write(NOTE.pack(len(data)))
+        outfile.write(data)
+        length += NOTE.size + len(data)
+    return length
+
+def mapFile(path):
+    """ Return a read-only memory map of the file at path. """
+
+    infile = open(path, 'rb')
+    filemap = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    infile.close()
+    return filemap
+
+def writeProject(path, notes, topics, reader=None, meta=None, readers=()):
+    """ Write the note deque and topic list to an indexed project at path, and
+        return the block that each topic was written to along with a reader
+        of the new file. Topics that have a block are copied over from that
+        block of topic['reader'] (or reader) without decoding their notes.
+        meta is a dict of settings to store with the project. readers are
+        any other readers kept by the caller that may map path. """
+
+    names = [encodeText(topic['name']) for topic in topics]
+    meta = json.dumps(meta or {})
+    indexSize = (HEADER.size + BLOCK.size +
+                 sum(NAME.size + len(name) + NUMBER.size + BLOCK.size
+                     for name in names) +
+                 NOTE.size + len(meta))
+
+    temppath = path + ".tmp"
+    outfile = open(temppath, 'wb')
+    outfile.write("\0" * indexSize)
+
+    offset = indexSize
+    length = writeBlock(outfile, notes)
+    blocks = [(len(notes), offset, length)]
+    offset += length
+
+    # Reader of the file that each copied block is read from -> where the
+    # block goes in the new file
+    copied = {}
+    for topic in topics:
+        if topic.get('block') is not None:
+            source, block = (topic.get('reader') or
+                             reader).resolve(topic['block'])
+            count, start, length = block
+            outfile.write(source.read(start, length))
+            copied.setdefault(source, {})[block] = (count, offset, length)
+        else:
+            count = len(topic['notes'])
+            length = writeBlock(outfile, topic['notes'])
+        blocks.append((count, offset, length))
+        offset += length
+
+    outfile.seek(0)
+    outfile.write(HEADER.pack(MAGIC, VERSION, len(topics)))
+    outfile.write(BLOCK.pack(*blocks[0]))
+    for name, topic, block in zip(names, topics, blocks[1:]):
+        outfile.write(NAME.pack(len(name)))
+        outfile.write(name)
+        outfile.write(NUMBER.pack(topic['number']))
+        outfile.write(BLOCK.pack(*block))
+    outfile.write(NOTE.pack(len(meta)))
+    outfile.write(meta)
+
+    outfile.flush()
+    os.fsync(outfile.fileno())
+    outfile.close()
+
+    # Windows will not replace a file that is still mapped, so every map of
+    # the old file is closed first, and its reader then reads the blocks
+    # that were copied out of it from the new file
+    kept = set(r for r in [reader] + list(readers) +
+               [topic.get('reader') for topic in topics] if r is not None)
+    mapped = [r for r in set(r.current() for r in kept) if r.path == path]
+    replaced = False
+    for old in mapped:
+        old.lock.acquire()
+    try:
+        for old in mapped:
+            old.unmap()
+        replaceFile(temppath, path)
+        replaced = True
+        newReader = ProjectReader(path)
+        for old in mapped:
+            old.forward = (newReader, copied.get(old, {}))
+    except:
+        # The old file is still there to be read if it was not replaced
+        if not replaced and os.path.exists(path):
+            for old in mapped:
+                old.map = mapFile(path)
+        raise
+    finally:
+        for old in mapped:
+            old.lock.release()
+
+    # Readers that already forwarded to a closed map now forward straight to
+    # the new file, so that they do not keep a chain of old readers alive
+    for r in kept:
+        r.skip(mapped)
+
+    return blocks[1:], newReader
+
+
+class ProjectReader():
+    """ Reads the index of an indexed project from a memory-mapped file, and
+        decodes the notes of a block only when they are asked for. """
+
+    def __init__(self, path):
+        self.path = path
+        # Held while the map is read or closed, since the Tk thread decodes
+        # topics while the I/O thread saves
+        self.lock = threading.Lock()
+        # Once the file has been replaced by a save, the reader of the new
+        # file and where each block of this file was copied to in it, set
+        # together so that the Tk thread never sees one without the other
+        self.forward = None
+
+        self.map = mapFile(path)
+
+        magic, version, count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version not in VERSIONS:
+            raise IOError("Not an indexed Outliner project: " + path)
+
+        offset = HEADER.size
+        self.notes = BLOCK.unpack_from(self.map, offset)
+        offset += BLOCK.size
+
+        # (name, number, block) of each topic in the index
+        self.topics = []
+        for i in range(count):
+            (length,) = NAME.unpack_from(self.map, offset)
+            offset += NAME.size
+            name = self.map[offset:offset + length].decode('utf-8')
+            offset += length
+            (number,) = NUMBER.unpack_from(self.map, offset)
+            offset += NUMBER.size
+            block = BLOCK.unpack_from(self.map, offset)
+            offset += BLOCK.size
+            self.topics.append((name, number, block))
+
+        # Settings stored with the project
+        self.meta = {}
+        if version >= 2:
+            (length,) = NOTE.unpack_from(self.map, offset)
+            offset += NOTE.size
+            self.meta = json.loads(self.map[offset:offset + length])
+
+    def current(self):
+        """ Return the reader that maps the file holding this reader's blocks
+            now. """
+
+        reader = self
+        while reader.forward is not None:
+            reader = reader.forward[0]
+        return reader
+
+    def resolve(self, block):
+        """ Return the reader that maps the given block of this reader's file,
+            and where the block is in that reader's file. """
+
+        reader = self
+        while reader.forward is not None:
+            reader, block = reader.forward[0], reader.forward[1][block]
+        return reader, block
+
+    def skip(self, closed):
+        """ Forward straight to the file that replaced the closed readers,
+            if this reader forwarded to one of them. """
+
+        if self.forward is None or self.forward[0] not in closed:
+            return
+        successor, moved = self.forward
+        forward = successor.forward
+        self.forward = (forward[0],
+                        dict((block, forward[1][to]) for block, to in
+                             moved.items() if to in forward[1]))
+
+    def read(self, offset, length):
+        """ Return the raw bytes at offset of a file that is still mapped. """
+
+        with self.lock:
+            return self.map[offset:offset + length]
+
+    def readNotes(self, block):
+        """ Decode and return the notes in the given block. """
+
+        with self.lock:
+            if self.forward is None:
+                return self.decodeNotes(block)
+            successor, moved = self.forward
+        return successor.readNotes(moved[block])
+
+    def decodeNotes(self, block):
+        """ Decode the notes in a block of the mapped file. """
+
+        count, offset, length = block
+        notes = []
+        for i in range(count):
+            (size,) = NOTE.unpack_from(self.map, offset)
+            offset += NOTE.size
+            notes.append(self.map[offset:offset + size].decode('utf-8'))
+            offset += size
+        return notes
+
+    def unmap(self):
+        """ Unmap the project file, if it is still mapped. The caller must
+            hold the reader's lock. """
+
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    def close(self):
+        """ Unmap the project file. """
+
+        with self.lock:
+            self.unmap()
@@ -0,0 +1,227 @@
+"""
+ "  File: outlinercli.py
+ "  Written By: Gregory Owen
+ "
+ "  Command-line interface for exporting, converting and inspecting projects
+ "  in bulk, without a display
+ "
+ "  Usage: python outlinercli.py export|convert|stats|dedup [options] PROJECT...
+"""
+
+from multiprocessing import Pool
+import argparse
+import os
+import sys
+import time
+
+from outlinercompress import COMPRESSIONS, checkCompression
+from outlinerexport import RENDERERS
+from outlinermodel import OutlinerModel, convertProject
+
+def outputPath(projectpath, outdir, extension):
+    """ Return the path to write the output for projectpath to, replacing its
+        extension and moving it into outdir if one is given. """
+
+    path = os.path.splitext(projectpath)[0] + extension
+    if outdir is not None:
+        path = os.path.join(outdir, os.path.basename(path))
+    return path
+
+def sharedOutputs(projectpaths, outdir, extension):
+    """ Return the output paths that more than one of projectpaths would be
+        written to, each mapped to the projects that would write it. """
+
+    writers = {}
+    for projectpath in projectpaths:
+        path = os.path.abspath(outputPath(projectpath, outdir, extension))
+        writers.setdefault(path, []).append(projectpath)
+    return dict((path, projects) for path, projects in writers.items()
+                if len(projects) > 1)
+
+def exportJob(projectpath, outdir, format):
+    """ Export the project at projectpath to an outline in the given format,
+        or to standard output if outdir is "-". """
+
+    model = OutlinerModel(None)
+    model.openModel(projectpath)
+    if outdir == "-":
+        exportpath = "-"
+    else:
+        exportpath = outputPath(projectpath, outdir, "." + format)
+    model.writeExport(exportpath, model.prepareExport(), format=format)
+    return exportpath
+
+def convertJob(projectpath, outdir, extension, compression=False, level=None):
+    """ Convert the project at projectpath to the format of extension, with
+        the compression and level given by convertProject. """
+
+    outpath = outputPath(projectpath, outdir, extension)
+    convertProject(projectpath, outpath, compression, level)
+    return outpath
+
+def statsJob(projectpath):
+    """ Return a summary of the size of the project at projectpath. """
+
+    model = OutlinerModel(None)
+    model.openModel(projectpath)
+    assigned = sum(model.noteCount(topic) for topic in model.topics.values())
+    return "%d topics, %d assigned notes, %d unassigned notes, %d bytes" % (
+        len(model.topics), assigned, len(model.notes),
+        os.path.getsize(projectpath))
+
+def dedupJob(projectpath, threshold, merge):
+    """ Find the notes in the project at projectpath that repeat another note.
+        If merge is True, drop the unassigned duplicates and save the
+        project. """
+
+    model = OutlinerModel(None)
+    model.openModel(projectpath)
+    if not merge:
+        found = model.findDuplicates(threshold)
+        unassigned = sum(1 for noteid in model.notes if noteid in found)
+        return "%d duplicate notes, %d of them unassigned" % (len(found),
+                                                              unassigned)
+
+    discarded, flagged = model.mergeDuplicates(threshold)
+    model.saveModel()
+    return "%d unassigned duplicate notes removed, %d in topics kept" % (
+        discarded, flagged)
+
+def runJob(job):
+    """ Run one command on one project in a worker process, and return the
+        project, the result or error message, and the time taken. """
+
+    command, projectpath, args = job
+    start = time.time()
+    try:
+        if command == 'export':
+            result = exportJob(projectpath, *args)
+        elif command == 'convert':
+            result = convertJob(projectpath, *args)
+        elif command == 'dedup':
+            result = dedupJob(projectpath, *args)
+        else:
+            result = statsJob(projectpath)
+        failed = False
+    except Exception as error:
+        result = "%s: %s" % (type(error).__name__, error)
+        failed = True
+    return projectpath, result, failed, time.time() - start
+
+def makeParser():
+    """ Return the parser for the command line. """
+
+    parser = argparse.ArgumentParser(
+        prog="outliner",
+        description="Export, convert or inspect Outliner projects in bulk.")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of worker processes (default: one per "
+                             "core)")
+    commands = parser.add_subparsers(dest="command")
+
+    export = commands.add_parser("export", help="export projects to outlines")
+    export.add_argument("-f", "--format", choices=sorted(RENDERERS),
+                        default="txt", help="format of the outlines "
+                                            "(default: txt)")
+    export.add_argument("-o", "--outdir", default=None,
+                        help="directory to write outlines to, or - for "
+                             "standard output (default: next to each "
+                             "project)")
+    export.add_argument("projects", nargs="+")
+
+    convert = commands.add_parser("convert",
+                                  help="convert projects between .otln and "
+                                       ".otlb")
+    convert.add_argument("--to", choices=["otln", "otlb"], required=True,
+                         help="format to convert to")
+    convert.add_argument("-o", "--outdir", default=None,
+                         help="directory to write projects to (default: next "
+                              "to each project)")
+    convert.add_argument("-z", "--compress",
+                         choices=["none"] + list(COMPRESSIONS), default=None,
+                         help="compression of .otln projects (default: keep "
+                              "that of each project)")
+    convert.add_argument("--level", type=int, default=None,
+                         help="compression level, 1-9 for gzip or 0-9 for "
+                              "lzma (default: 6)")
+    convert.add_argument("projects", nargs="+")
+
+    stats = commands.add_parser("stats", help="report the size of projects")
+    stats.add_argument("projects", nargs="+")
+
+    dedup = commands.add_parser("dedup",
+                                help="find notes that repeat other notes")
+    dedup.add_argument("-t", "--threshold", type=float, default=0.8,
+                       help="similarity from 0 to 1 at which two notes count "
+                            "as duplicates (default: 0.8)")
+    dedup.add_argument("--merge", action="store_true",
+                       help="remove unassigned duplicates and save the "
+                            "projects")
+    dedup.add_argument("projects", nargs="+")
+
+    return parser
+
+def main(argv=None):
+    """ Run the command line, return the exit status. """
+
+    args = makeParser().parse_args(argv)
+
+    # Keep the report off standard output if outlines are written there
+    report = sys.stdout
+    extension = None
+    if args.command == 'export':
+        extra = (args.outdir, args.format)
+        if args.outdir == "-":
+            report = sys.stderr
+            args.jobs = 1
+        else:
+            extension = "." + args.format
+    elif args.command == 'convert':
+        if args.compress is None:
+            compression = False
+        elif args.compress == "none":
+            compression = None
+        else:
+            compression = args.compress
+            try:
+                checkCompression(compression, args.level)
+            except ValueError as error:
+                makeParser().error(str(error))
+        extra = (args.outdir, "." + args.to, compression, args.level)
+        extension = "." + args.to
+    elif args.command == 'dedup':
+        extra = (args.threshold, args.merge)
+    else:
+        extra = ()
+    jobs = [(args.command, path, extra) for path in args.projects]
+
+    # Jobs run at the same time, so two projects written to the same file
+    # would overwrite each other
+    if extension is not None:
+        shared = sharedOutputs(args.projects, args.outdir, extension)
+        if len(shared) > 0:
+            path, projects = sorted(shared.items())[0]
+            makeParser().error("%s would all be written to %s" %
+                               (", ".join(projects), path))
+
+    status = 0
+    start = time.time()
+    pool = Pool(args.jobs)
+    try:
+        for path, result, failed, elapsed in pool.imap_unordered(runJob, jobs):
+            print >>report, "%s\t%.3fs\t%s%s" % (path, elapsed,
+                                                 "FAILED " if failed else "",
+                                                 result)
+            report.flush()
+            if failed:
+                status = 1
+    finally:
+        pool.close()
+        pool.join()
+
+    print >>report, "%d project(s) in %.3fs" % (len(jobs),
+                                                time.time() - start)
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
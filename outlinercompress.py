@@ -0,0 +1,85 @@
+"""
+ "  File: outlinercompress.py
+ "  Written By: Gregory Owen
+ "
+ "  Optional gzip or lzma compression of .otln project files, which are
+ "  recognized by their magic bytes when they are opened
+"""
+
+import gzip
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+COMPRESSIONS = ('gzip', 'lzma')
+MAGIC = {'gzip': "\x1f\x8b", 'lzma': "\xfd7zXZ\x00"}
+# Compression levels run from 1 to 9 for gzip and from 0 to 9 for lzma
+DEFAULT_LEVEL = {'gzip': 6, 'lzma': 6}
+LEVELS = {'gzip': range(1, 10), 'lzma': range(0, 10)}
+
+def available(compression):
+    """ Return True if projects can be compressed with compression. """
+
+    return compression == 'gzip' or (compression == 'lzma' and
+                                     lzma is not None)
+
+def checkCompression(compression, level=None):
+    """ Raise ValueError if projects cannot be compressed with compression at
+        the given level. None means no compression. """
+
+    if compression is None:
+        return
+    if compression not in COMPRESSIONS:
+        raise ValueError("Unknown compression: %s" % compression)
+    if not available(compression):
+        raise ValueError("lzma compression requires the lzma module "
+                         "(backports.lzma on Python 2)")
+    if level is not None and level not in LEVELS[compression]:
+        raise ValueError("%s compression levels run from %d to %d" %
+                         (compression, LEVELS[compression][0],
+                          LEVELS[compression][-1]))
+
+def detectCompression(path):
+    """ Return the compression of the file at path, or None if it is not
+        compressed. """
+
+    infile = open(path, 'rb')
+    magic = infile.read(max(len(magic) for magic in MAGIC.values()))
+    infile.close()
+    for compression, start in MAGIC.items():
+        if magic.startswith(start):
+            return compression
+    return None
+
+def openReader(path, compression):
+    """ Return a file object that reads the file at path, decompressing it as
+        it is read. """
+
+    if compression is None:
+        return open(path, 'r')
+    checkCompression(compression)
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    return lzma.LZMAFile(path, 'rb')
+
+def openWriter(rawfile, compression, level=None):
+    """ Return a file object that compresses what is written to it into the
+        open binary file rawfile. Closing it finishes the compressed stream
+        but leaves rawfile open, so that it can still be synced. """
+
+    if compression is None:
+        return rawfile
+    checkCompression(compression, level)
+    if level is None:
+        level = DEFAULT_LEVEL[compression]
+    if compression == 'gzip':
+        # A fixed modification time keeps the output the same for the same
+        # project
+        return gzip.GzipFile(filename="", mode='wb', compresslevel=level,
+                             fileobj=rawfile, mtime=0)
+    return lzma.LZMAFile(rawfile, 'wb', preset=level)
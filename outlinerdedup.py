@@ -0,0 +1,114 @@
+"""
+ "  File: outlinerdedup.py
+ "  Written By: Gregory Owen
+ "
+ "  Detection of notes that repeat, or nearly repeat, an earlier note
+"""
+
+import hashlib
+import re
+import zlib
+
+WORD = re.compile(r"\w+", re.UNICODE)
+
+class DuplicateFinder():
+    """ Finds notes that repeat an earlier note exactly, ignoring case, spacing
+        and punctuation, or nearly.
+
+        Near duplicates are found with MinHash over the pairs of adjacent words
+        in each note. Each pair is hashed once into one of a number of bins,
+        keeping the smallest hash in each bin (one-permutation MinHash). Notes
+        that agree on every bin of some band of bins become candidates
+        (locality-sensitive hashing), and a candidate is a duplicate if the
+        Jaccard similarity of the two notes' word pairs reaches the threshold.
+        Each note is hashed once and only compared with the few notes that
+        share a band with it, so finding duplicates takes roughly linear time. """
+
+    def __init__(self, threshold=0.8, bins=32, bands=8, maxCandidates=50):
+        self.threshold = threshold
+        self.bins = bins
+        self.bands = bands
+        self.rows = bins / bands
+        # Most notes sharing one band that a note is compared with
+        self.maxCandidates = maxCandidates
+
+        # Digest of the normalized text of each note -> note id
+        self.exact = {}
+        # (band, hashes in the band) -> ids of the notes with those hashes
+        self.buckets = {}
+        # Note id -> hashes of the note's word pairs
+        self.shingles = {}
+
+    def sketch(self, text):
+        """ Return the digest, word pair hashes and band keys of text. """
+
+        if not isinstance(text, unicode):
+            text = text.decode('utf-8', 'replace')
+        words = [word.encode('utf-8') for word in WORD.findall(text.lower())]
+        if len(words) == 0:
+            # Notes of punctuation alone, such as "***", only repeat a note
+            # with the same text, and have no words to compare
+            return (hashlib.md5(text.strip().encode('utf-8')).digest(),
+                    frozenset(), [])
+        digest = hashlib.md5(" ".join(words)).digest()
+
+        pairs = [a + " " + b for a, b in zip(words, words[1:])] or words
+        shingles = frozenset(zlib.crc32(pair) & 0xffffffff for pair in pairs)
+
+        minimums = [None] * self.bins
+        for shingle in shingles:
+            i = shingle % self.bins
+            value = shingle / self.bins
+            if minimums[i] is None or value < minimums[i]:
+                minimums[i] = value
+
+        # Bands with no hashes at all say nothing about similarity
+        keys = []
+        for band in range(self.bands):
+            values = tuple(minimums[band * self.rows:(band + 1) * self.rows])
+            if any(value is not None for value in values):
+                keys.append((band, values))
+
+        return digest, shingles, keys
+
+    def find(self, text):
+        """ Return the id of a note that text duplicates, or None, along with
+            the sketch of text to pass to add. """
+
+        sketch = self.sketch(text)
+        digest, shingles, keys = sketch
+
+        if digest in self.exact:
+            return self.exact[digest], sketch
+
+        checked = set()
+        for key in keys:
+            for other in self.buckets.get(key, ())[-self.maxCandidates:]:
+                if other in checked:
+                    continue
+                checked.add(other)
+                others = self.shingles[other]
+                similarity = (float(len(shingles & others)) /
+                              len(shingles | others))
+                if similarity >= self.threshold:
+                    return other, sketch
+
+        return None, sketch
+
+    def add(self, noteid, sketch):
+        """ Remember a note so that later notes can be found to duplicate it. """
+
+        digest, shingles, keys = sketch
+        self.exact.setdefault(digest, noteid)
+        self.shingles[noteid] = shingles
+        for key in keys:
+            self.buckets.setdefault(key, []).append(noteid)
+
+    def check(self, noteid, text):
+        """ Return the id of a note that the given note duplicates, or None
+            after remembering the note. """
+
+        original, sketch = self.find(text)
+        if original is None:
+            self.add(noteid, sketch)
+        return original
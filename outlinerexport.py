@@ -0,0 +1,97 @@
+"""
+ "  File: outlinerexport.py
+ "  Written By: Gregory Owen
+ "
+ "  Renderers that turn the topics of a project into an outline
+"""
+
+from cgi import escape
+import json
+import os
+
+"""
+A renderer takes the topics to export, in order, and a function that returns
+the text of a note given its id, and yields the outline as chunks of text. The
+whole outline is never held in memory at once.
+"""
+
+def renderText(topics, text):
+    """ Render the outline as plain text, with each note indented under its
+        topic. """
+
+    for topic in topics:
+        yield topic['name'] + ":\n"
+        for noteid in topic['notes']:
+            yield "\t" + text(noteid) + "\n\n"
+        yield "\n"
+
+def renderMarkdown(topics, text):
+    """ Render the outline as Markdown, with a heading for each topic and a
+        list item for each note. """
+
+    for topic in topics:
+        yield "## " + topic['name'] + "\n\n"
+        for noteid in topic['notes']:
+            yield "- " + text(noteid) + "\n"
+        yield "\n"
+
+def renderHTML(topics, text):
+    """ Render the outline as an HTML page, with a heading for each topic and a
+        list item for each note. """
+
+    yield ("<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"utf-8\">\n"
+           "<title>Outline</title>\n</head>\n<body>\n")
+    for topic in topics:
+        yield "<h2>" + escape(topic['name']) + "</h2>\n<ul>\n"
+        for noteid in topic['notes']:
+            yield "<li>" + escape(text(noteid)) + "</li>\n"
+        yield "</ul>\n"
+    yield "</body>\n</html>\n"
+
+def renderJSONLines(topics, text):
+    """ Render the outline as one JSON object per note, giving the note, its
+        topic and its position in the outline. """
+
+    for number, topic in enumerate(topics):
+        for position, noteid in enumerate(topic['notes']):
+            yield json.dumps({'topic': topic['name'], 'number': number,
+                              'position': position,
+                              'note': text(noteid)}) + "\n"
+
+RENDERERS = {'txt': renderText, 'md': renderMarkdown, 'html': renderHTML,
+             'jsonl': renderJSONLines}
+
+EXTENSIONS = {'.md': 'md', '.markdown': 'md', '.html': 'html', '.htm': 'html',
+              '.jsonl': 'jsonl'}
+
+def formatFor(exportpath):
+    """ Return the format to export to exportpath in, based on its extension.
+        Plain text is the default. """
+
+    extension = os.path.splitext(exportpath)[1].lower()
+    return EXTENSIONS.get(extension, 'txt')
+
+def trackProgress(topics, progress):
+    """ Yield topics, calling progress with the fraction of them that have been
+        rendered so far. """
+
+    for i, topic in enumerate(topics):
+        if progress is not None:
+            progress(float(i) / len(topics))
+        yield topic
+
+def writeChunks(outfile, chunks, buffersize=1 << 16):
+    """ Write chunks of text to outfile in writes of about buffersize bytes. """
+
+    buffered = []
+    size = 0
+    for chunk in chunks:
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode('utf-8')
+        buffered.append(chunk)
+        size += len(chunk)
+        if size >= buffersize:
+            outfile.write("".join(buffered))
+            buffered = []
+            size = 0
+    outfile.write("".join(buffered))
@@ -6,9 +6,13 @@
 """ 
 
 from Tkinter import *
+from collections import OrderedDict
+import os
 
 from outlinermenu import OutlinerMenu
 from outlinermodel import OutlinerModel
+from outlinerprofile import instrument
+from outlinerview import VirtualNoteList, itemOf
 import dndlist
 
 class TopicLine(Frame):
@@ -19,6 +23,7 @@ class TopicLine(Frame):
         Frame.__init__(self, **args)
 
         self.topic = topic
+        self.model = outliner.model
 
         labelText = StringVar()
         label = Label(self, textvariable=labelText)
@@ -38,10 +43,9 @@ class TopicLine(Frame):
     def getLabelText(self):
         """ Returns the text that should be displayed on this topic line. """
 
-        endChar = '' if (len(self.topic['notes']) == 1) else 's'
-        labelText = "%s:%d note%s" % (self.topic['name'],
-                                      len(self.topic['notes']), 
-                                      endChar)
+        count = self.model.noteCount(self.topic)
+        endChar = '' if (count == 1) else 's'
+        labelText = "%s:%d note%s" % (self.topic['name'], count, endChar)
         return labelText
 
     def updateLabel(self):
@@ -62,34 +66,88 @@ class OutlinerGUI:
         self.defaultWidth = 700
         self.defaultHeight = 800
 
+        # Topics with more notes than this are displayed a window at a time
+        self.virtualThreshold = 200
+        self.virtualRowHeight = 40
+
         geoString = str(self.defaultWidth) + "x" + str(self.defaultHeight)
         self.root.geometry(geoString)
 
         self.menu = OutlinerMenu(self.outliner, self.root) 
+        self.makeStatusBar()
         self.essayFrame = self.upperFrame = self.makeEssayFrame()
         self.noteFrame = self.lowerFrame = self.makeNoteFrame()
         self.packFrames()
 
         self.makeReturnFrame()
+        self.makeTopicSurface()
         self.currTopic = None
         self.dragNote = None
+        self.previewLabel = None
+        # Updates waiting to be drawn together once the Tk mainloop is idle:
+        # notes and topic lines that were dragged and dropped, (topic, note
+        # ids) whose labels are to be added, topics whose lines are out of
+        # date, and whether the current note has changed
+        self.pendingDrops = []
+        self.pendingLabels = []
+        self.dirtyTopics = {}
+        self.noteDirty = False
+        self.flushJob = None
+
+        # Only the most recently viewed topics keep their rendered frames
+        # (name -> topic, least recently viewed first), and the labels of the
+        # topics that are released are kept to be reused, up to a limit
+        self.maxRenderedTopics = 8
+        self.renderedTopics = OrderedDict()
+        self.maxPooledLabels = 400
+        self.labelPool = []
 
     """ -------------------------------------------------------------------- """
     """                            General methods                           """
     """ -------------------------------------------------------------------- """
 
+    @instrument()
     def openGUI(self):
         """ Initialize the GUI from a previous project. """
 
-        # Sort the topics by number
-        sortedTopicNames = sorted(self.model.topics,
-                                  key=(lambda name:
-                                           self.model.topics[name]['number']))
-        
-        for name in sortedTopicNames:
-            topic = self.model.topics[name]
+        for topic in self.model.orderedTopics():
             self.initializeTopicGUI(topic)
 
+    def closeProjectGUI(self):
+        """ Return to the main view, release the rendered topic frames and
+            remove the topic lines of the project that is open, before
+            another project takes its place. """
+
+        self.flushUpdates()
+        self.returnToMain()
+        if (self.shownTopic is not None and
+            self.shownTopic.get('frame') is not None):
+            self.shownTopic['frame'].pack_forget()
+        self.shownTopic = None
+        while len(self.renderedTopics) > 0:
+            name, topic = self.renderedTopics.popitem(last=False)
+            self.releaseTopicFrame(topic)
+
+        for node in self.topicList.getOrdered():
+            self.topicList.removeItem(itemOf(self.topicList, node.widget))
+            node.widget.destroy()
+        for topic in self.model.topics.values():
+            topic['line'] = None
+        self.menu.clearTopicLists()
+
+    def makeStatusBar(self):
+        """ Make and deploy the status bar along the bottom of the window. """
+
+        self.statusText = StringVar()
+        statusBar = Label(self.root, textvariable=self.statusText, anchor=W,
+                          relief=SUNKEN, borderwidth=1)
+        statusBar.pack(side=BOTTOM, fill=X)
+
+    def showStatus(self, text):
+        """ Display text in the status bar. """
+
+        self.statusText.set(text)
+
     def packFrames(self):
         """ Pack self.upperFrame above self.lowerFrame. """
 
@@ -115,57 +173,140 @@ class OutlinerGUI:
 
         return essayFrame
 
+    def showPreview(self, preview):
+        """ Show the current note and topic list cached for a project that is
+            still being loaded, as plain text over the topic list. """
+
+        lines = ["%s:%d note%s" % (name, count, '' if count == 1 else 's')
+                 for name, count in preview['topics']]
+        if preview.get('moreTopics'):
+            lines.append("... and %d more topics" % preview['moreTopics'])
+
+        self.previewLabel = Label(self.essayFrame, text="\n".join(lines),
+                                  justify=LEFT, anchor=NW, fg="gray30")
+        self.previewLabel.place(relx=0, rely=0, relwidth=1, relheight=1)
+
+        if preview.get('note') is not None:
+            self.noteText.set(preview['note'])
+
+    def clearPreview(self):
+        """ Remove the preview once the project has been loaded. """
+
+        if self.previewLabel is not None:
+            self.previewLabel.destroy()
+            self.previewLabel = None
+
     """ -------------------------------------------------------------------- """
     """                          Topic Frame methods                         """
     """ -------------------------------------------------------------------- """
 
-    def addNoteToGUI(self, topic, note):
-        """ Add note to the DNDList of the given topic. """
+    def addNoteToGUI(self, topic, noteid):
+        """ Add a note to the DNDList of the given topic. Topics that have not
+            been viewed yet have no DNDList, and pick up the note from
+            topic['notes'] when they are first viewed. """
+
+        self.addNotesToGUI(topic, [noteid])
+
+    def addNotesToGUI(self, topic, noteids):
+        """ Add several notes to the DNDList of the given topic. Their labels
+            are added on the next flush of updates. """
 
-        node = topic['dndlist'].addItem(self.createNoteLabel(note))
+        if topic.get('dndlist') is None:
+            return
+        if (len(self.pendingLabels) > 0 and
+            self.pendingLabels[-1][0] is topic):
+            self.pendingLabels[-1][1].extend(noteids)
+        else:
+            self.pendingLabels.append((topic, list(noteids)))
+        self.scheduleFlush()
+
+    @instrument()
+    def addNoteLabel(self, topic, noteid):
+        """ Add a label for the note with the given id to the end of the
+            DNDList of the given topic and return it. """
+
+        node = topic['dndlist'].addItem(self.createNoteLabel(noteid))
         node.widget.bind("<Button-1>", self.onClick, add='+')
         node.widget.bind("<B1-Motion>", self.onMotion, add='+')
         node.widget.bind("<ButtonRelease-1>", self.onRelease, add='+')
+        return node.widget
 
-    def createNoteLabel(self, text):
-        """ Create a label with the given text to be added to a DNDList. """
+    def createNoteLabel(self, noteid):
+        """ Create a label for the note with the given id to be added to a
+            DNDList, reusing a pooled label if there is one. The label
+            remembers the id of the note that it shows. """
 
-        args = {"wraplength": self.defaultWidth - 200, "relief": RAISED,
-                "borderwidth": 2}
-        label = Label(text=text, **args)
+        if len(self.labelPool) > 0:
+            label = self.labelPool.pop()
+            label.config(text=self.model.noteText(noteid))
+        else:
+            args = {"wraplength": self.defaultWidth - 200, "relief": RAISED,
+                    "borderwidth": 2}
+            label = Label(text=self.model.noteText(noteid), **args)
+        label.noteid = noteid
 
         return label
 
+    def recycleLabel(self, label):
+        """ Keep a label that has been taken off its DNDList to be reused,
+            unbinding it from that DNDList, or destroy it if the pool is
+            full. Note labels belong to the root window rather than to a
+            topic's frame, so they outlive the frame. """
+
+        if len(self.labelPool) >= self.maxPooledLabels:
+            label.destroy()
+            return
+
+        for sequence in label.bind():
+            label.unbind(sequence)
+        self.labelPool.append(label)
+
+    @instrument()
     def initializeTopicGUI(self, topic):
-        """ Initialize the GUI components related to the given topic. """
+        """ Initialize the GUI components related to the given topic. The
+            topic's frame is built the first time that the topic is viewed. """
 
         topic['line'] = self.newTopicLine(topic)
-        self.newTopicFrame(topic)
+        topic['frame'] = topic['dndlist'] = topic['vlist'] = None
         self.menu.addToTopicLists(topic)
 
+    def makeTopicSurface(self):
+        """ Make the frame in which every topic is viewed, with the frame into
+            which notes are dragged to be removed above the topic's notes, but
+            do not deploy it. """
+
+        self.topicSurface = Frame(self.root)
+        self.removeFrame = Frame(self.topicSurface, width=self.defaultWidth,
+                                 height=30, relief=SOLID, borderwidth=2)
+        self.removeLabel = Label(self.removeFrame,
+                                 text="Drag note here to remove from topic")
+
+        self.removeLabel.pack()
+        self.removeFrame.pack(side=TOP, fill=X)
+        # The topic whose frame is packed into the surface
+        self.shownTopic = None
+
+    @instrument()
     def newTopicFrame(self, topic):
         """ Create a new dndlist for the given topic and populate it with the
             topic's notes (if any). """
 
-        frame = Frame(self.root)
-        
-        removeFrame = Frame(frame, width=self.defaultWidth, height=30,
-                            relief=SOLID, borderwidth=2)
-        removeLabel = Label(removeFrame,
-                            text="Drag note here to remove from topic")
+        frame = Frame(self.topicSurface)
+        topic['frame'] = frame
 
-        removeLabel.pack()
-        removeFrame.pack(side=TOP, fill=X)
-        
-        dndl = dndlist.DNDList(frame, self.defaultWidth, 
-                               self.defaultHeight - 130)
+        # Long topics only get labels for the notes that fit on the canvas
+        if len(topic['notes']) > self.virtualThreshold:
+            topic['vlist'] = VirtualNoteList(self, topic, frame,
+                                             self.defaultWidth,
+                                             self.defaultHeight - 130)
+            return
 
-        topic['frame'] = frame
-        topic['rframe'] = removeFrame
-        topic['dndlist'] = dndl
-        
-        for note in topic['notes']:
-            self.addNoteToGUI(topic, note)
+        topic['vlist'] = None
+        topic['dndlist'] = dndlist.DNDList(frame, self.defaultWidth,
+                                           self.defaultHeight - 130)
+
+        for noteid in topic['notes']:
+            self.addNoteLabel(topic, noteid)
 
     def newTopicLine(self, topic):
         """ Create a new line for the given topic, add it to the dndlist of 
@@ -174,8 +315,16 @@ class OutlinerGUI:
         line = TopicLine(topic, self.outliner, width=(self.defaultWidth - 100),
                          height=30, relief=RAISED, borderwidth=2)
         self.topicList.addItem(line)
+        line.bind("<ButtonRelease-1>", self.onTopicRelease, add='+')
         return line
 
+    def onTopicRelease(self, event):
+        """ When a topic line is released it may have been dragged to a new
+            place, which is copied to the model on the next flush. """
+
+        self.pendingDrops.append(('topic', event.widget.topic))
+        self.scheduleFlush()
+
     def onClick(self, event):
         """ When an item on the canvas is clicked, store that item's id. """
 
@@ -189,7 +338,7 @@ class OutlinerGUI:
 
         if self.dragNote is not None:
             x, y = self.currTopic['dndlist'].getClickCoords()
-            label = self.currTopic['rframe'].winfo_children()[0]
+            label = self.removeLabel
             
             if y < 0 and label.cget('fg') != "red":                
                 label.config(fg="red")
@@ -207,37 +356,136 @@ class OutlinerGUI:
         # if the mouse is currently in the remove frame
         if y < 0:
             self.removeNoteFromTopic(self.currTopic, self.dragNote)
-            self.currTopic['rframe'].winfo_children()[0].config(fg="black")
+            self.removeLabel.config(fg="black")
+        else:
+            # The note may have been dragged to a new place in the topic
+            noteid = self.currTopic['dndlist'].getItem(
+                self.dragNote).widget.noteid
+            self.pendingDrops.append(('note', self.currTopic, noteid))
+            self.scheduleFlush()
 
         self.dragNote = None
 
-    def removeNoteFromTopic(self, topic, noteid):
-        """ Remove the note with the given id from the given topic. Push the
-            text of the note onto the left of the note deque. """
+    def removeNoteFromTopic(self, topic, itemid):
+        """ Remove the note on the canvas item with the given id from the given
+            topic. Push the note onto the left of the note deque. """
 
-        text = topic['dndlist'].getItem(noteid).widget.cget('text')
+        self.flushUpdates()
+        label = topic['dndlist'].getItem(itemid).widget
+        noteid = label.noteid
 
-        topic['dndlist'].removeItem(noteid)
-        topic['notes'].remove(text)
+        if topic.get('vlist') is not None:
+            topic['vlist'].sync()
+            self.model.removeNoteFromTopic(topic, noteid)
+            topic['vlist'].show()
+        else:
+            topic['dndlist'].removeItem(itemid)
+            self.recycleLabel(label)
+            self.model.removeNoteFromTopic(topic, noteid)
 
-        self.model.notes.appendleft(text)
         self.updateTopicGUI(topic)
         self.displayNextNote()
 
     def updateTopicGUI(self, topic):
-        """ Update all GUI components relating to the given topic. """
+        """ Update all GUI components relating to the given topic on the next
+            flush of updates. """
 
-        topic['line'].updateLabel()
+        self.dirtyTopics[topic['name']] = topic
+        self.scheduleFlush()
 
+    @instrument()
     def viewTopic(self, topic):
         """ Display the notes that are part of the topic. """
 
+        if topic.get('frame') is None:
+            self.model.loadTopic(topic)
+            self.newTopicFrame(topic)
+        self.renderedTopics.pop(topic['name'], None)
+        self.renderedTopics[topic['name']] = topic
+
+        if self.shownTopic is not topic:
+            if (self.shownTopic is not None and
+                self.shownTopic.get('frame') is not None):
+                self.shownTopic['frame'].pack_forget()
+            topic['frame'].pack(side=TOP, fill=BOTH, expand=True)
+            self.shownTopic = topic
+
         self.currTopic = topic
         self.unpackFrames()
-        self.upperFrame = topic['frame']
+        self.upperFrame = self.topicSurface
         self.lowerFrame = self.returnFrame
         self.packFrames()
 
+        while len(self.renderedTopics) > self.maxRenderedTopics:
+            name, oldest = self.renderedTopics.popitem(last=False)
+            self.releaseTopicFrame(oldest)
+
+    @instrument()
+    def releaseTopicFrame(self, topic):
+        """ Destroy the rendered frame of a topic that has not been viewed
+            recently, once any notes dropped in it have been moved in the
+            model, and pool its note labels. It is built again from
+            topic['notes'] if it is viewed again. """
+
+        self.flushUpdates()
+        labels = [node.widget for node in topic['dndlist'].getOrdered()]
+        topic['frame'].destroy()
+        topic['frame'] = topic['dndlist'] = topic['vlist'] = None
+        for label in labels:
+            self.recycleLabel(label)
+
+    def showChanges(self, records):
+        """ Redraw what the records applied by an undo or redo changed. The
+            topics whose notes changed are built again from the model when
+            they are next viewed, or at once if one is being viewed, and the
+            topic lines are laid out again if a topic moved. """
+
+        names = set(record['topic'] for record in records
+                    if record['op'] != 'place' and
+                    record.get('topic') is not None)
+        for name in names:
+            topic = self.model.topics[name]
+            if topic.get('frame') is not None:
+                viewed = self.currTopic is topic
+                self.renderedTopics.pop(name, None)
+                if self.shownTopic is topic:
+                    self.shownTopic = None
+                self.releaseTopicFrame(topic)
+                if viewed:
+                    self.viewTopic(topic)
+            self.updateTopicGUI(topic)
+
+        if any(record['op'] == 'place' for record in records):
+            self.layOutTopicLines()
+        self.displayNextNote()
+
+    def layOutTopicLines(self):
+        """ Replace the topic lines with new ones in the order of the
+            outline. """
+
+        for topic in self.model.topics.values():
+            self.topicList.removeItem(itemOf(self.topicList, topic['line']))
+            topic['line'].destroy()
+        for topic in self.model.orderedTopics():
+            topic['line'] = self.newTopicLine(topic)
+
+    def showNoteInTopic(self, topic, noteid):
+        """ View the topic and bring the note with the given id into view,
+            highlighting its label for a moment. """
+
+        self.viewTopic(topic)
+        self.flushUpdates()
+        if topic.get('vlist') is not None:
+            topic['vlist'].scrollTo(topic['notes'].index(noteid))
+
+        for node in topic['dndlist'].getOrdered():
+            if node.widget.noteid == noteid:
+                background = node.widget.cget('background')
+                node.widget.config(background="yellow")
+                self.root.after(1500, lambda w=node.widget, b=background:
+                                w.config(background=b))
+                break
+
     """ -------------------------------------------------------------------- """
     """                          Note Frame methods                          """
     """ -------------------------------------------------------------------- """
@@ -260,6 +508,12 @@ class OutlinerGUI:
 
         self.noteLabel.pack(side=LEFT, expand=YES)
 
+        # Where the current note is among the unassigned notes
+        self.positionText = StringVar()
+        positionLabel = Label(noteFrame, textvariable=self.positionText,
+                              fg="gray30")
+        positionLabel.pack(side=RIGHT)
+
         nextButton = Button(noteFrame, text="Next") 
         nextButton.config(command=(lambda: self.outliner.nextNote()))
         nextButton.pack(side=TOP)
@@ -271,12 +525,105 @@ class OutlinerGUI:
         return noteFrame
 
     def displayNextNote(self):
-        """ Display the first note in the list. """
+        """ Display the first note in the list on the next flush of
+            updates. """
+
+        self.noteDirty = True
+        self.scheduleFlush()
+
+    def drawNextNote(self):
+        """ Show the first note in the list in the note frame. """
 
         if len(self.outliner.model.notes) > 0:
-            self.noteText.set(self.outliner.model.notes[0])
+            noteid = self.model.notes[0]
+            self.noteText.set(self.model.noteText(noteid))
+            position = "Note {:,} of {:,}".format(
+                self.model.notePosition() + 1, len(self.model.notes))
+            origin = self.model.noteOrigin(noteid)
+            if origin is not None:
+                position += "\n%s:%d" % (os.path.basename(origin[0]),
+                                          origin[1])
+            self.positionText.set(position)
+            if noteid in self.model.duplicates:
+                self.showStatus("This note may repeat another note")
         else:
             self.noteText.set("No more notes.")
+            self.positionText.set("")
+
+    """ -------------------------------------------------------------------- """
+    """                            Update methods                            """
+    """ -------------------------------------------------------------------- """
+
+    def scheduleFlush(self):
+        """ Flush the pending updates once the Tk mainloop is next idle, so
+            that a burst of changes is drawn only once. """
+
+        if self.flushJob is None:
+            self.flushJob = self.root.after_idle(self.flushUpdates)
+
+    @instrument()
+    def flushUpdates(self):
+        """ Apply the pending updates now: move dropped notes and topics in
+            the model, add the waiting note labels, update each changed topic
+            line once and show the current note. Must be called before
+            reading a topic's DNDList or saving the model. """
+
+        if self.flushJob is not None:
+            self.root.after_cancel(self.flushJob)
+            self.flushJob = None
+
+        drops = self.pendingDrops
+        self.pendingDrops = []
+        for drop in drops:
+            if drop[0] == 'note':
+                self.noteDropped(drop[1], drop[2])
+            else:
+                self.topicDropped(drop[1])
+
+        pending = self.pendingLabels
+        self.pendingLabels = []
+        refreshed = set()
+        for topic, noteids in pending:
+            if topic.get('vlist') is not None:
+                # A windowed topic is redrawn once however many notes it got
+                if topic['name'] not in refreshed:
+                    refreshed.add(topic['name'])
+                    topic['vlist'].refresh()
+            else:
+                for noteid in noteids:
+                    self.addNoteLabel(topic, noteid)
+
+        dirty = self.dirtyTopics
+        self.dirtyTopics = {}
+        for topic in dirty.values():
+            if topic.get('line') is not None:
+                topic['line'].updateLabel()
+
+        if self.noteDirty:
+            self.noteDirty = False
+            self.drawNextNote()
+
+    def noteDropped(self, topic, noteid):
+        """ Move a note that was dragged within the topic to the place where
+            it was dropped. The DNDList only gives the whole order of its
+            labels, but the model moves just the one note. """
+
+        if topic.get('dndlist') is None:
+            return
+        ordered = [node.widget.noteid for node in
+                   topic['dndlist'].getOrdered()]
+        if noteid in ordered:
+            first = topic['vlist'].first if topic.get('vlist') else 0
+            self.model.moveNote(topic, noteid, first + ordered.index(noteid))
+
+    def topicDropped(self, topic):
+        """ Move a topic whose line was dragged to the place where it was
+            dropped. """
+
+        for index, node in enumerate(self.topicList.getOrdered()):
+            if node.widget.topic is topic:
+                self.model.moveTopic(topic, index)
+                return
 
     """ -------------------------------------------------------------------- """
     """                         Return Frame methods                         """
@@ -0,0 +1,143 @@
+"""
+ "  File: outlinerhistory.py
+ "  Written By: Gregory Owen
+ "
+ "  Undo and redo history of the changes made to a project, kept as the
+ "  journal records that reverse each change
+"""
+
+from collections import deque
+
+# Rough number of bytes taken by a record and by each id or position in it,
+# used to keep the history under its memory cap
+RECORD_BYTES = 300
+ID_BYTES = 40
+
+def recordBytes(record):
+    """ Return the estimated size of a record in memory. """
+
+    return RECORD_BYTES + ID_BYTES * (len(record.get('notes', ())) +
+                                      len(record.get('positions', ())))
+
+
+class UndoHistory():
+    """ The steps that can be undone and redone. Each step is the list of
+        records that reverses one change, so a step takes memory in
+        proportion to the change rather than to the project, and undoing or
+        redoing a step only applies those records. The oldest steps are
+        forgotten once the history takes more than maxBytes. """
+
+    def __init__(self, maxBytes=8 << 20):
+        self.maxBytes = maxBytes
+        # Steps as (records, bytes), the most recent last
+        self.undoSteps = deque()
+        self.redoSteps = []
+        self.size = 0
+        # The records of the step being recorded, the stack that it goes on,
+        # and how many calls to begin have not been ended yet
+        self.step = None
+        self.target = None
+        self.depth = 0
+
+    def clear(self):
+        """ Forget every step, as when another project is opened. """
+
+        self.undoSteps.clear()
+        self.redoSteps = []
+        self.size = 0
+
+    def canUndo(self):
+        """ Return True if there is a step to undo. """
+
+        return len(self.undoSteps) > 0
+
+    def canRedo(self):
+        """ Return True if there is an undone step to redo. """
+
+        return len(self.redoSteps) > 0
+
+    def begin(self, target='change'):
+        """ Start collecting the records that reverse the changes made until
+            the matching call to end into a single step. target is 'change'
+            for a new change, or 'undo' or 'redo' while a step is being
+            undone or redone. Calls may be nested. """
+
+        if self.depth == 0:
+            self.step = []
+            self.target = target
+        self.depth += 1
+
+    def end(self):
+        """ Finish the step started by the matching call to begin. """
+
+        self.depth -= 1
+        if self.depth > 0:
+            return
+
+        step = self.step
+        self.step = None
+        if len(step) == 0:
+            return
+        if self.target == 'undo':
+            self.push(self.redoSteps, step)
+        else:
+            if self.target == 'change':
+                self.dropSteps(self.redoSteps)
+            self.push(self.undoSteps, step)
+        self.trim()
+
+    def record(self, records):
+        """ Add the records that reverse a change that has just been made to
+            the current step, or to a step of its own. They are applied in
+            the order given, after the records of later changes. """
+
+        if self.depth == 0:
+            self.begin()
+            self.step[0:0] = records
+            self.end()
+        else:
+            self.step[0:0] = records
+
+    def push(self, steps, records):
+        """ Put a step on the undo or redo stack. """
+
+        size = sum(recordBytes(record) for record in records)
+        steps.append((records, size))
+        self.size += size
+
+    def pop(self, steps):
+        """ Take the most recent step off the undo or redo stack and return its
+            records, or None if the stack is empty. """
+
+        if len(steps) == 0:
+            return None
+        records, size = steps.pop()
+        self.size -= size
+        return records
+
+    def dropSteps(self, steps):
+        """ Forget every step on the redo stack once a new change is made. """
+
+        for records, size in steps:
+            self.size -= size
+        del steps[:]
+
+    def trim(self):
+        """ Forget the oldest steps until the history fits under its cap. """
+
+        while self.size > self.maxBytes and len(self.undoSteps) > 0:
+            records, size = self.undoSteps.popleft()
+            self.size -= size
+        if self.size > self.maxBytes:
+            self.dropSteps(self.redoSteps)
+
+    def takeUndo(self):
+        """ Return the records that undo the most recent step, or None. """
+
+        return self.pop(self.undoSteps)
+
+    def takeRedo(self):
+        """ Return the records that redo the most recently undone step, or
+            None. """
+
+        return self.pop(self.redoSteps)
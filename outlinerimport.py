@@ -0,0 +1,107 @@
+"""
+ "  File: outlinerimport.py
+ "  Written By: Gregory Owen
+ "
+ "  Imports folders of note files, parsing the files in a pool of worker
+ "  processes, and records the file and line that each note came from
+"""
+
+from multiprocessing import Pool
+import os
+
+# Extensions of the files in a folder that are read as note files
+NOTE_EXTENSIONS = (".txt", ".md", ".text", "")
+
+def splitNotes(text):
+    """ Return (line, note) for each note in text, where line is the line on
+        which the note starts, counted from 1. Notes are split exactly as
+        OutlinerModel.readNotes splits them: on blank lines, with the lines of
+        each note joined with spaces. """
+
+    notes = []
+    stripped = text.strip()
+    if stripped == "":
+        return notes
+
+    line = text.count("\n", 0, len(text) - len(text.lstrip())) + 1
+    for piece in stripped.split("\n\n"):
+        if piece != "":
+            start = line + len(piece) - len(piece.lstrip("\n"))
+            notes.append((start, piece.replace("\n", " ")))
+        line += piece.count("\n") + 2
+    return notes
+
+def parseNoteFile(path):
+    """ Read and split the note file at path in a worker process. Return the
+        path, its (line, note) pairs and an error message or None. """
+
+    try:
+        infile = open(path, 'r')
+        try:
+            text = infile.read()
+        finally:
+            infile.close()
+    except (IOError, OSError) as error:
+        return path, [], str(error)
+    return path, splitNotes(text), None
+
+def listNoteFiles(folder, extensions=NOTE_EXTENSIONS):
+    """ Return the paths of the note files under folder, sorted so that a
+        folder is always imported in the same order. Hidden files and
+        folders are skipped. """
+
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(folder):
+        dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+        for name in filenames:
+            if (not name.startswith(".") and
+                os.path.splitext(name)[1].lower() in extensions):
+                paths.append(os.path.join(dirpath, name))
+    return sorted(paths)
+
+def parseNoteFiles(paths, processes=None):
+    """ Yield the result of parseNoteFile for each of paths, in the order of
+        paths, parsing up to processes files at once (default: one per core).
+        Workers run ahead of the caller, so the files are read in parallel
+        while their notes are merged one file at a time. """
+
+    if processes == 1 or len(paths) < 2:
+        for path in paths:
+            yield parseNoteFile(path)
+        return
+
+    pool = Pool(processes)
+    try:
+        for result in pool.imap(parseNoteFile, paths):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+def encodeOrigins(origins, noteids, files):
+    """ Return [position, file, line] for each of noteids that has an origin
+        in origins (note id -> (path, line)), where position is the place of
+        the note in noteids and file is the number of its path in files (an
+        OrderedDict of path -> number, to which new paths are added). """
+
+    entries = []
+    for position, noteid in enumerate(noteids):
+        origin = origins.get(noteid)
+        if origin is not None:
+            number = files.setdefault(origin[0], len(files))
+            entries.append([position, number, origin[1]])
+    return entries
+
+def decodeOrigins(entries, paths, noteids, origins):
+    """ Record the origins encoded by encodeOrigins for noteids in origins,
+        where paths lists the files by number. """
+
+    for position, number, line in entries:
+        origins[noteids[position]] = (paths[number], line)
+
+def recodeOrigins(entries, paths, files):
+    """ Return entries that were encoded against the list paths encoded
+        against files instead. """
+
+    return [[position, files.setdefault(paths[number], len(files)), line]
+            for position, number, line in entries]
\ No newline at end of file
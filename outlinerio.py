@@ -0,0 +1,115 @@
+"""
+ "  File: outlinerio.py
+ "  Written By: Gregory Owen
+ "
+ "  Runs the Outliner's file I/O on a worker thread
+"""
+
+import Queue
+import threading
+
+class IOExecutor():
+    """ Runs project file I/O jobs one at a time on a worker thread. Progress
+        and completion are passed back to the Tk thread, which polls for them
+        with root.after while there are jobs outstanding. """
+
+    def __init__(self, root, interval=50):
+        self.root = root
+        self.interval = interval
+        self.jobs = Queue.Queue()
+        self.events = Queue.Queue()
+        self.lock = threading.Lock()
+        # Save that is queued but not started yet, so it can be coalesced
+        self.queuedSave = None
+        self.outstanding = 0
+
+        worker = threading.Thread(target=self.work)
+        worker.daemon = True
+        worker.start()
+
+    def submit(self, func, done=None, progress=None):
+        """ Run func(report) on the worker thread, where func may call
+            report(fraction) to report its progress. progress(fraction) and
+            done(result, error) are called on the Tk thread. """
+
+        job = {'kind': None, 'func': func, 'done': done, 'progress': progress}
+        self.enqueue(job)
+
+    def submitSave(self, kind, func, done=None, progress=None):
+        """ Like submit, for a save of the given kind (as returned by
+            OutlinerModel.prepareSave). If a save is still waiting to start, a
+            journal save is merged into it, and a full save replaces it, since
+            only the latest state of the project needs to be written. """
+
+        with self.lock:
+            queued = self.queuedSave
+            if queued is not None and kind != 'journal':
+                queued.update(kind=kind, func=func, done=done,
+                              progress=progress)
+                return
+            elif queued is not None and queued['kind'] == 'journal':
+                # The queued save appends every record queued when it runs
+                return
+
+            job = {'kind': kind, 'func': func, 'done': done,
+                   'progress': progress}
+            self.queuedSave = job
+
+        self.enqueue(job)
+
+    def enqueue(self, job):
+        """ Queue job for the worker and make sure that the Tk thread polls for
+            its results. Must be called from the Tk thread. """
+
+        self.outstanding += 1
+        self.jobs.put(job)
+        if self.outstanding == 1:
+            self.root.after(self.interval, self.poll)
+
+    def work(self):
+        """ Run queued jobs on the worker thread. """
+
+        while True:
+            job = self.jobs.get()
+            with self.lock:
+                if job is self.queuedSave:
+                    self.queuedSave = None
+                func = job['func']
+
+            report = (lambda fraction, job=job:
+                          self.events.put(('progress', job, fraction)))
+            try:
+                self.events.put(('done', job, func(report), None))
+            except Exception as error:
+                self.events.put(('done', job, None, error))
+
+            self.jobs.task_done()
+
+    def poll(self):
+        """ Pass progress and results from the worker to their callbacks, and
+            keep polling while jobs are outstanding even if a callback
+            raises. """
+
+        try:
+            while True:
+                try:
+                    event = self.events.get_nowait()
+                except Queue.Empty:
+                    break
+
+                job = event[1]
+                if event[0] == 'progress':
+                    if job['progress'] is not None:
+                        job['progress'](event[2])
+                else:
+                    self.outstanding -= 1
+                    if job['done'] is not None:
+                        job['done'](event[2], event[3])
+        finally:
+            if self.outstanding > 0:
+                self.root.after(self.interval, self.poll)
+
+    def finish(self):
+        """ Wait for every queued job to be written. """
+
+        self.jobs.join()
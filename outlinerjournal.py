@@ -0,0 +1,227 @@
+"""
+ "  File: outlinerjournal.py
+ "  Written By: Gregory Owen
+ "
+ "  Append-only journal of the changes made to a project since its last
+ "  snapshot was written
+"""
+
+import json
+import os
+import threading
+
+"""
+Notes are referred to by the id that they are given when the snapshot is
+opened, which is their position in the snapshot.
+
+Records in the journal (one JSON object per line):
+  base:   First line of the journal, names the snapshot generation that the
+          rest of the journal applies to
+  add:    Pop the current note and append it to a topic
+  remove: Remove a note from a topic and push it onto the left of the note
+          deque
+  assign: Move notes from anywhere in the note deque to the end of a topic
+  discard: Drop notes from the note deque
+  restore: Put notes back into the note deque at the positions that they
+          were taken from, taking them out of a topic if one is
+          given; written when a change is undone
+  import: Append notes read from the end of the source note file to the note
+          deque, and record how far into the file has been read
+  rotate: Rotate the note deque by a number of steps
+  topic:  Create a new topic
+  order:  Replace a slice of a topic's notes with the same notes in a new order
+  number: Put the topics in the given order (written by older versions)
+  move:   Move a note to a new position within its topic
+  place:  Move a topic to a new position in the outline
+"""
+
+def replaceFile(temppath, path):
+    """ Atomically replace the file at path with the file at temppath. """
+
+    if os.name == 'nt' and os.path.exists(path):
+        # Windows will not rename over an existing file
+        os.remove(path)
+    os.rename(temppath, path)
+
+
+class ProjectJournal():
+    """ Queues records of the changes made to a project and appends them to
+        the project's journal on save. Records are queued from the Tk thread
+        and may be appended from the I/O thread. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.path = None
+        self.generation = None
+        self.records = []
+        self.count = 0
+        self.valid = False
+        # Maps note ids in the model to note ids in the snapshot, or None if
+        # they are the same
+        self.fileIds = None
+        # Write a fresh snapshot once the journal holds this many records
+        self.compactLimit = 2000
+
+    def journalPath(self, path):
+        """ Return the path of the journal for the project file at path. """
+
+        return path + ".journal"
+
+    def record(self, record):
+        """ Queue a record to be appended on the next save. Records are only
+            kept while there is a snapshot on disk for them to apply to. """
+
+        with self.lock:
+            if not self.valid:
+                return
+
+            try:
+                if self.fileIds is not None and 'note' in record:
+                    record['note'] = self.fileIds[record['note']]
+                if self.fileIds is not None and 'notes' in record:
+                    record['notes'] = [self.fileIds[noteid]
+                                       for noteid in record['notes']]
+            except KeyError:
+                # A note that is not in the snapshot, such as a discarded
+                # note brought back by undo, can only be saved in a new one
+                self.valid = False
+                self.records = []
+                return
+
+            if (record['op'] == 'rotate' and len(self.records) > 0 and
+                self.records[-1]['op'] == 'rotate'):
+                self.records[-1]['steps'] += record['steps']
+            else:
+                self.records.append(record)
+
+    def addNotes(self, noteids):
+        """ Give the notes with the given ids, which are about to be appended
+            to the store by a journaled record, the next ids in the snapshot. """
+
+        with self.lock:
+            if self.valid and self.fileIds is not None:
+                for noteid in noteids:
+                    self.fileIds[noteid] = len(self.fileIds)
+
+    def invalidate(self):
+        """ Force the next save to write a full snapshot. """
+
+        with self.lock:
+            self.valid = False
+            self.records = []
+
+    def needsSnapshot(self, path):
+        """ Return True if saving to path must write a full snapshot rather
+            than append to the journal. """
+
+        return (not self.valid or path != self.path or
+                self.count + len(self.records) > self.compactLimit)
+
+    def begin(self, path, generation, fileIds=None):
+        """ Queue records for a new, empty journal for the snapshot with the
+            given generation that is about to be written to path. fileIds maps
+            the ids of the notes in the model to their ids in the snapshot. """
+
+        with self.lock:
+            self.path = path
+            self.generation = generation
+            self.fileIds = fileIds
+            self.records = []
+            self.count = 0
+            self.valid = True
+
+    def discard(self, path):
+        """ Remove the journal of the project file at path, once a newer
+            snapshot has replaced the snapshot that it applied to. """
+
+        journalpath = self.journalPath(path)
+        if os.path.exists(journalpath):
+            os.remove(journalpath)
+
+    def start(self, path, generation):
+        """ Begin a new, empty journal for the snapshot that was just written
+            to path with the given generation. """
+
+        self.discard(path)
+        self.begin(path, generation)
+
+    def append(self, generation=None):
+        """ Append the queued records to the journal on disk. If generation is
+            given, only append them if the journal still belongs to the
+            snapshot with that generation. """
+
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            if len(self.records) == 0:
+                return
+
+            records = self.records
+            self.records = []
+            path = self.journalPath(self.path)
+            lines = [json.dumps(record) for record in records]
+            if self.count == 0:
+                lines.insert(0, json.dumps({'op': 'base',
+                                            'generation': self.generation}))
+            mode = 'w' if self.count == 0 else 'a'
+            self.count += len(records)
+
+        outfile = open(path, mode)
+        outfile.write("\n".join(lines) + "\n")
+        outfile.flush()
+        os.fsync(outfile.fileno())
+        outfile.close()
+
+    def replay(self, path, generation):
+        """ Return the records in the journal of the project file at path if it
+            applies to the snapshot with the given generation, and continue
+            that journal on later saves. A stale journal is discarded. """
+
+        journalpath = self.journalPath(path)
+        lines = []
+        records = []
+        torn = False
+
+        if generation is None:
+            # Projects saved before journaling have no generation, so the
+            # first save must write a snapshot that a journal can refer to
+            self.invalidate()
+            return records
+
+        if os.path.exists(journalpath):
+            infile = open(journalpath, 'r')
+            lines = infile.read().split("\n")
+            infile.close()
+
+        try:
+            base = json.loads(lines[0])
+        except (IndexError, ValueError):
+            base = {}
+
+        if base.get('generation') != generation:
+            self.start(path, generation)
+            return records
+
+        for line in lines[1:]:
+            if line == "":
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # A save was interrupted partway through this line
+                torn = True
+                break
+
+        if torn:
+            # Drop the torn line so that later records are appended cleanly
+            lines = [lines[0]] + [json.dumps(record) for record in records]
+            outfile = open(journalpath + ".tmp", 'w')
+            outfile.write("\n".join(lines) + "\n")
+            outfile.flush()
+            os.fsync(outfile.fileno())
+            outfile.close()
+            replaceFile(journalpath + ".tmp", journalpath)
+
+        self.begin(path, generation)
+        self.count = len(records)
+        return records
@@ -7,21 +7,36 @@
 
 from Tkinter import *
 
+from outlinercompress import available
+from outlinersearch import TopicIndex
+from outlinerview import TopicPalette
+
 class OutlinerMenu():
 
     def __init__(self, outliner, root):
         """ Initialize the menu to contain File and Topic options. """
 
         self.outliner = outliner
+        # Topics are picked from a palette that searches this index, rather
+        # than from a menu entry per topic
+        self.topicIndex = TopicIndex(topic['name'] for topic in
+                                     outliner.model.topics.values())
 
         self.menubar = Frame(root, relief=RAISED, borderwidth=2)
         self.menubar.pack(side=TOP, fill=X)
         
         FileBtn = self.makeFileMenu()
+        EditBtn = self.makeEditMenu()
         self.TopicBtn = self.makeTopicMenu()
         self.NoteBtn = self.makeNoteMenu()
 
-        self.menubar.tk_menuBar(FileBtn, self.TopicBtn, self.NoteBtn)
+        self.menubar.tk_menuBar(FileBtn, EditBtn, self.TopicBtn, self.NoteBtn)
+
+        root.bind("<Control-g>", lambda event: self.pickTopicToView())
+        root.bind("<Control-t>", lambda event: self.pickTopicForNote())
+        root.bind("<Control-j>", lambda event: self.outliner.goToNote())
+        root.bind("<Control-z>", lambda event: self.outliner.undo())
+        root.bind("<Control-y>", lambda event: self.outliner.redo())
 
     """ ------------------------ File menu methods ------------------------- """
 
@@ -34,6 +49,8 @@ class OutlinerMenu():
 
         FileBtn.menu.add_command(label="New Project", underline=0, 
                                  command=self.outliner.newProject)
+        FileBtn.menu.add_command(label="Import Folder...", underline=0,
+                                 command=self.outliner.importFolder)
         FileBtn.menu.add_command(label="Open Project", underline=0,
                                  command=self.outliner.openProject)
         FileBtn.menu.add_command(label="Save Project", underline=0, 
@@ -42,12 +59,74 @@ class OutlinerMenu():
                                  command=self.outliner.saveProjectAs)
         FileBtn.menu.add_command(label="Export Outline", underline=0,
                                  command=self.outliner.exportOutline)
+        FileBtn.menu.add_cascade(label="Compress Project", underline=0,
+                                 menu=self.makeCompressMenu(FileBtn.menu))
+        FileBtn.reopenLast = BooleanVar()
+        FileBtn.reopenLast.set(self.outliner.session.reopenLast())
+        FileBtn.menu.add_checkbutton(
+            label="Reopen Last Project on Startup", underline=0,
+            variable=FileBtn.reopenLast,
+            command=(lambda: self.outliner.session.setReopenLast(
+                FileBtn.reopenLast.get())))
+        FileBtn.menu.add_command(label="Performance", underline=0,
+                                 command=self.outliner.showPerformance)
         FileBtn.menu.add_command(label="Quit", underline=0,
                                  command = self.outliner.quit)
 
         FileBtn['menu'] = FileBtn.menu
         return FileBtn
 
+    def makeCompressMenu(self, parent):
+        """ Make the submenu that chooses how the project file is compressed,
+            showing the compression of the open project whenever it is
+            posted. """
+
+        compression = StringVar()
+        menu = Menu(parent, postcommand=(lambda: compression.set(
+            self.outliner.model.compression or "none")))
+        for label, value in (("None", "none"), ("gzip", "gzip"),
+                             ("lzma", "lzma")):
+            menu.add_radiobutton(
+                label=label, value=value, variable=compression,
+                state=(NORMAL if value == "none" or available(value)
+                       else DISABLED),
+                command=lambda: self.outliner.setCompression(
+                    compression.get()))
+        menu.add_separator()
+        menu.add_command(label="Level...", underline=0,
+                         command=self.outliner.chooseCompressionLevel)
+        return menu
+
+    """ ------------------------ Edit menu methods ------------------------- """
+
+    def makeEditMenu(self):
+        """ Initialize the Edit options in the menu. """
+
+        EditBtn = Menubutton(self.menubar, text="Edit", underline=0)
+        EditBtn.pack(side=LEFT, padx="2m")
+        EditBtn.menu = Menu(EditBtn, postcommand=lambda: self.showHistory(
+            EditBtn.menu))
+
+        EditBtn.menu.add_command(label="Undo", underline=0,
+                                 accelerator="Ctrl+Z",
+                                 command=self.outliner.undo)
+        EditBtn.menu.add_command(label="Redo", underline=0,
+                                 accelerator="Ctrl+Y",
+                                 command=self.outliner.redo)
+
+        EditBtn['menu'] = EditBtn.menu
+        return EditBtn
+
+    def showHistory(self, menu):
+        """ Enable Undo and Redo only when there is something to undo or
+            redo. """
+
+        history = self.outliner.model.history
+        menu.entryconfig("Undo", state=(NORMAL if history.canUndo()
+                                        else DISABLED))
+        menu.entryconfig("Redo", state=(NORMAL if history.canRedo()
+                                        else DISABLED))
+
     """ ------------------------ Topic menu methods ------------------------ """
 
     def makeTopicMenu(self):
@@ -56,35 +135,38 @@ class OutlinerMenu():
         TopicBtn = Menubutton(self.menubar, text="Topic", underline=0)
         TopicBtn.pack(side=LEFT, padx="2m")
         TopicBtn.menu = Menu(TopicBtn)
-        TopicBtn.menu.topicList = Menu(TopicBtn.menu)
-
-        for topic in self.outliner.model.topics.keys():
-            TopicBtn.menu.topicList.add_command(
-                label=topic["name"],
-                underline=0,
-                command=(lambda o=self.outliner, t=topic: o.viewTopic(t)))
 
         TopicBtn.menu.add_command(label="New Topic", underline=0, 
                                   command=self.outliner.newTopic)
-        TopicBtn.menu.add_cascade(label="View Topic",
-                                  menu=TopicBtn.menu.topicList)
+        TopicBtn.menu.add_command(label="View Topic...", underline=0,
+                                  accelerator="Ctrl+G",
+                                  command=self.pickTopicToView)
 
         TopicBtn['menu'] = TopicBtn.menu
         return TopicBtn
 
     def addToTopicLists(self, topic):
-        """ Append topic to the list of topics in the View Topic option in the
-            Topic menu and in the Add To Topic option in the Note Menu. """
+        """ Make topic available to the View Topic and Add To Topic
+            palettes. """
+
+        self.topicIndex.add(topic['name'])
+
+    def clearTopicLists(self):
+        """ Forget the topics of a project that has been closed. """
+
+        self.topicIndex = TopicIndex()
 
-        self.TopicBtn.menu.topicList.add_command(
-            label=topic["name"],
-            underline=0,
-            command=(lambda o=self.outliner, t=topic: o.viewTopic(t)))
-        self.NoteBtn.menu.topicList.add_command(
-            label=topic["name"],
-            underline=0,
-            command=(lambda o=self.outliner, t=topic: o.addNoteToTopic(t)))
+    def pickTopicToView(self):
+        """ Open a palette for choosing a topic to view. """
 
+        TopicPalette(self.outliner, "View Topic", self.outliner.viewTopic)
+
+    def pickTopicForNote(self):
+        """ Open a palette for choosing a topic to add the current note to. """
+
+        if len(self.outliner.model.notes) > 0:
+            TopicPalette(self.outliner, "Add To Topic",
+                         self.outliner.addNoteToTopic)
 
     """ ------------------------ Note menu methods ------------------------- """
 
@@ -94,20 +176,36 @@ class OutlinerMenu():
         NoteBtn = Menubutton(self.menubar, text="Note", underline=0)
         NoteBtn.pack(side=LEFT, padx="2m")
         NoteBtn.menu = Menu(NoteBtn)
-        NoteBtn.menu.topicList = Menu(NoteBtn.menu)
-        
-        for topic in self.outliner.model.topics.keys():
-            NoteBtn.menu.topicList.add_command(
-                label=topic["name"],
-                underline=0,
-                command=(lambda o=self.outliner, t=topic: o.addNoteToTopic(t)))
-
-        NoteBtn.menu.add_cascade(label="Add To Topic",
-                                 menu=NoteBtn.menu.topicList)
+
+        NoteBtn.menu.add_command(label="Add To Topic...", underline=0,
+                                 accelerator="Ctrl+T",
+                                 command=self.pickTopicForNote)
         NoteBtn.menu.add_command(label="Next Note", underline=0,
                                  command=self.outliner.nextNote)
         NoteBtn.menu.add_command(label="Prev Note", underline=0,
                                  command=self.outliner.prevNote)
+        NoteBtn.menu.add_command(label="Go To Note...", underline=0,
+                                 accelerator="Ctrl+J",
+                                 command=self.outliner.goToNote)
+        NoteBtn.menu.add_command(label="Search Notes", underline=0,
+                                 command=self.outliner.searchNotes)
+        NoteBtn.menu.add_command(label="Remove Duplicates", underline=0,
+                                 command=self.outliner.removeDuplicates)
+        NoteBtn.menu.add_command(label="Suggest Topic", underline=0,
+                                 command=self.outliner.suggestTopic)
+        NoteBtn.menu.add_command(label="Bulk Assign", underline=0,
+                                 command=self.outliner.bulkAssign)
+        NoteBtn.follow = BooleanVar()
+        NoteBtn.menu.add_checkbutton(
+            label="Follow Note File", underline=0, variable=NoteBtn.follow,
+            command=lambda: self.followSource(NoteBtn.follow))
 
         NoteBtn['menu'] = NoteBtn.menu
         return NoteBtn
+
+    def followSource(self, follow):
+        """ Start or stop following the project's note file, unticking the
+            menu entry if there is no note file to follow. """
+
+        if not self.outliner.followSource(follow.get()):
+            follow.set(False)
@@ -5,117 +5,1202 @@
  "  Model for the Outliner
 """ 
 
-from collections import deque
+from collections import OrderedDict
+from itertools import chain
 from operator import itemgetter
+from StringIO import StringIO
 import json
+import os
+import sys
+import uuid
+
+from outlinerbinary import ProjectReader, isBinaryProject, writeProject
+from outlinercompress import (checkCompression, detectCompression, openReader,
+                              openWriter)
+from outlinerdedup import DuplicateFinder
+from outlinerexport import RENDERERS, formatFor, trackProgress, writeChunks
+from outlinerhistory import UndoHistory
+from outlinerimport import (decodeOrigins, encodeOrigins, listNoteFiles,
+                            parseNoteFiles, recodeOrigins)
+from outlinerjournal import ProjectJournal, replaceFile
+from outlinerprofile import fileSize, instrument
+from outlinersearch import SearchIndex
+from outlinerstore import NoteList, NoteQueue, NoteStore
+from outlinersuggest import SuggestionEngine
 
 """
 Fields in a topic:
-  dndlist: DNDList containing this topic's notes (DNDList.dndlist)
-  frame:   Frame containing this topic's dndlist (Tkinter.Frame)
+  dndlist: DNDList containing this topic's notes, or None unless the topic is
+           one of the recently viewed topics that stay rendered
+           (DNDList.dndlist)
+  frame:   Frame in the GUI's topic surface containing this topic's dndlist,
+           or None whenever dndlist is None (Tkinter.Frame)
   line:    Information line about the topic on the main screen (Tkinter.Frame)
   name:    Subject of the topic, used to index into Outliner.topics (string)
-  notes:   Notes in the topic (list of strings)
-  number:  Number of topics created before this one (int)
-  rframe:  Frame into which notes are dragged to be removed (Tkinter.Frame)
+  block:   Where the topic's notes are stored in an indexed project if they
+           have not been decoded yet, otherwise None (tuple)
+  notes:   Ids of the notes in the topic (outlinerstore.NoteList)
+  number:  Position of the topic in the outline, only stored in project
+           files; in the model the order is kept by OutlinerModel.topicOrder
+           (int)
+  version: Number of changes made to the topic's notes since it was opened or
+           created (int)
+  vlist:   Windowed view of the notes in long topics, otherwise None
+           (outlinerview.VirtualNoteList)
 """
 
 class OutlinerModel():
 
     def __init__(self, outliner):
+        # outliner is None when the model is used without a GUI
         self.outliner = outliner
         self.filename = None
         self.topics = {}
-        self.notes = deque()
+        # Names of the topics in the order of the outline
+        self.topicOrder = NoteList()
+        # Notes are kept in the store, and referred to everywhere else by id
+        self.store = NoteStore()
+        self.notes = NoteQueue()
+        self.importChunkSize = 1 << 16
+        self.journal = ProjectJournal()
+        self.reader = None
+        # Number of changes made to the model, and the number that had been
+        # made when the project was last saved, to skip saves with no changes
+        self.version = 0
+        self.savedVersion = None
+        self.savedFilename = None
+        # Where the topics were written in the last indexed save, so that
+        # topics that have not changed since can be copied without encoding
+        self.savedBlocks = None
+        # Topic suggestions and the search index, each built the first time
+        # it is asked for and then kept up to date by updateIndexes
+        self.suggestions = None
+        self.search = None
+        # Ids of notes flagged as duplicates -> ids of the notes they repeat,
+        # and the number of duplicates merged away by the last import
+        self.duplicates = {}
+        self.mergedDuplicates = 0
+        # The note file that the notes were imported from and the number of
+        # bytes of it read so far, so that notes added to the end of it later
+        # can be read by pollSource, or None
+        self.source = None
+        # Files that the last folder import could not read
+        self.importErrors = []
+        # How .otln snapshots are compressed ('gzip', 'lzma' or None) and at
+        # what level (None for the default of the compression). Opening a
+        # project keeps the compression that it was saved with.
+        self.compression = None
+        self.compressionLevel = None
+        # The records that undo and redo the recent changes
+        self.history = UndoHistory()
 
-    def newModel(self, notepath):
+    @instrument(size=lambda self, notepath, *args: fileSize(notepath))
+    def newModel(self, notepath, chunksize=None, duplicates=None):
         """ Create a new project from the note file at notepath. """
 
+        for note in self.importNotes(notepath, chunksize, duplicates):
+            pass
+
+    def importNotes(self, notepath, chunksize=None, duplicates=None):
+        """ Append the notes in the note file at notepath to the model one at a
+            time, yielding the id of each note as soon as it has been
+            appended. Notes that repeat a note already in the model are
+            dropped if duplicates is 'merge', or appended and recorded in
+            self.duplicates if it is 'flag'. """
+
+        if chunksize is None:
+            chunksize = self.importChunkSize
+        finder = self.duplicateFinder() if duplicates is not None else None
+        self.mergedDuplicates = 0
+        self.importErrors = []
+
         try:
-            notefile = open(notepath, 'r')            
-            for note in notefile.read().strip().split("\n\n"):
-                if note != "":
-                    self.notes.append(" ".join(note.split("\n")))
+            notefile = open(notepath, 'r')
         except IOError:
             print "Error: no such file"
+            return
+
+        try:
+            # The last note may still be being written, so the source offset
+            # is kept at its start, for pollSource to read it again once it
+            # is finished
+            start, unfinished = self.lastNoteStart(notefile)
+            last = None
+            for note in self.readNotes(notefile, chunksize):
+                last = self.importNote(note, finder, duplicates)
+                if last is not None:
+                    yield last
+
+            self.source = {'path': os.path.abspath(notepath), 'offset': start,
+                           'note': last if unfinished else None}
+        finally:
+            notefile.close()
+
+    def lastNoteStart(self, notefile, chunksize=1 << 16):
+        """ Return the offset just past the last blank line in notefile, or 0
+            if it has none, and whether a note follows it. Only the end of the
+            file is read, and the file is left at its start. """
+
+        notefile.seek(0, os.SEEK_END)
+        end = notefile.tell()
+        tail = ""
+        while end > 0:
+            start = max(0, end - chunksize)
+            notefile.seek(start)
+            tail = notefile.read(end - start) + tail
+            found = tail.rfind("\n\n")
+            if found >= 0:
+                notefile.seek(0)
+                return start + found + 2, tail[found + 2:].strip() != ""
+            end = start
+
+        notefile.seek(0)
+        return 0, tail.strip() != ""
+
+    def importFolder(self, folder, processes=None, duplicates=None):
+        """ Append the notes in every note file under folder to the model,
+            yielding the id of each note as soon as it has been appended. The
+            files are read and split by up to processes worker processes at
+            once (default: one per core), but their notes are always appended
+            in the order of the sorted file paths, each tagged with the file
+            and line that it came from. Duplicates are handled as by
+            importNotes. The paths of files that could not be read are left
+            in self.importErrors. """
+
+        finder = self.duplicateFinder() if duplicates is not None else None
+        self.mergedDuplicates = 0
+        self.importErrors = []
+
+        paths = listNoteFiles(folder)
+        for path, notes, error in parseNoteFiles(paths, processes):
+            if error is not None:
+                self.importErrors.append(path)
+            for line, note in notes:
+                noteid = self.importNote(note, finder, duplicates,
+                                         (path, line))
+                if noteid is not None:
+                    yield noteid
+
+    def importNote(self, note, finder=None, duplicates=None, origin=None):
+        """ Append an imported note to the note deque and return its id, or
+            return None if it was merged away as a duplicate. """
+
+        if finder is not None:
+            original, sketch = finder.find(note)
+            if original is not None and duplicates == 'merge':
+                self.mergedDuplicates += 1
+                return None
+
+        # Imported notes are not journaled, so each one makes the next save
+        # a snapshot, even if a save was made partway through the import,
+        # and they shift the notes that the undo history refers to
+        self.journal.invalidate()
+        self.history.clear()
+        self.version += 1
+
+        noteid = self.store.add(note, origin)
+        self.notes.append(noteid)
+        self.updateIndexes('noteImported', noteid)
+
+        if finder is not None:
+            if original is None:
+                finder.add(noteid, sketch)
+            else:
+                self.duplicates[noteid] = original
+        return noteid
+
+    @instrument()
+    def pollSource(self):
+        """ Append the notes that have been added to the end of the source note
+            file since it was last read, and return their ids. Only the bytes
+            after the offset already read are looked at, and only up to the
+            last blank line, since the note after it may still be being
+            written. """
+
+        if self.source is None:
+            return []
+
+        offset = self.source['offset']
+        try:
+            size = os.path.getsize(self.source['path'])
+        except OSError:
+            return []
+
+        if size < offset:
+            # The file was truncated or replaced: follow it from its new end
+            self.perform({'op': 'import', 'texts': [], 'offset': size})
+            return []
+        elif size == offset:
+            return []
 
+        notefile = open(self.source['path'], 'r')
+        try:
+            notefile.seek(offset)
+            data = notefile.read(size - offset)
+        finally:
+            notefile.close()
+
+        end = data.rfind("\n\n")
+        if end < 0:
+            return []
+        end += 2
+
+        texts = list(self.readNotes(StringIO(data[:end]),
+                                    self.importChunkSize))
+
+        # A last note imported before it was finished is read again: it is
+        # left alone if it has not changed, and replaced if it has grown
+        # while it is still unassigned
+        note = self.source.get('note')
+        replace = None
+        if note is not None and len(texts) > 0:
+            if texts[0] == self.noteText(note):
+                texts = texts[1:]
+            elif self.notes.find(note) is not None:
+                replace = note
+        return self.appendNotes(texts, offset + end, replace)
+
+    def appendNotes(self, texts, offset, replace=None):
+        """ Append notes read from the source note file up to offset to the
+            note deque, return their ids. The first note takes the place of
+            the note with id replace, if it is given. """
+
+        first = len(self.store)
+        self.journal.addNotes(range(first, first + len(texts)))
+        record = {'op': 'import', 'texts': texts, 'offset': offset}
+        if replace is not None:
+            record['note'] = replace
+        return self.perform(record)
+
+    def readNotes(self, notefile, chunksize):
+        """ Yield the notes in notefile, reading chunksize bytes at a time.
+            Notes are separated by blank lines, and the lines of each note are
+            joined with spaces, exactly as if the whole stripped file had been
+            split on blank lines. """
+
+        buf = ""
+        started = False
+        # The last note with content is held back along with any
+        # whitespace-only notes after it, since they may turn out to be the
+        # trailing whitespace of the file
+        held = []
+
+        while True:
+            chunk = notefile.read(chunksize)
+            if chunk == "":
+                break
+
+            if not started:
+                chunk = chunk.lstrip()
+                started = chunk != ""
+
+            pieces = (buf + chunk).split("\n\n")
+            buf = pieces.pop()
+
+            for piece in pieces:
+                if piece.strip() != "":
+                    for note in held:
+                        if note != "":
+                            yield note.replace("\n", " ")
+                    held = []
+                held.append(piece)
+
+        held.append(buf)
+        while len(held) > 0 and held[-1].strip() == "":
+            held.pop()
+        if len(held) > 0:
+            held[-1] = held[-1].rstrip()
+
+        for note in held:
+            if note != "":
+                yield note.replace("\n", " ")
+
+    @instrument(size=lambda self, projectpath: fileSize(projectpath))
     def openModel(self, projectpath):
-        """ Open a previous project from its .otln file. """
+        """ Open a previous project from its .otln or .otlb file. """
         
         self.filename = projectpath
-        projectFile = open(projectpath, 'r')
+        self.suggestions = None
+        self.search = None
+        self.duplicates = {}
+        self.source = None
+        self.history.clear()
+        self.closeReaders()
+
+        if isBinaryProject(projectpath):
+            self.compression = None
+            self.openIndexedModel(projectpath)
+            return
+
+        # Compressed snapshots are recognized by their magic bytes and
+        # decompressed as they are read
+        self.compression = detectCompression(projectpath)
+        projectFile = openReader(projectpath, self.compression)
+
+        # Ids are given out in the order in which a snapshot is written, so
+        # that the journal can refer to notes by id
+        self.store = NoteStore()
 
         noteList = projectFile.readline()
-        self.notes = deque(json.loads(noteList))
+        self.notes = NoteQueue(self.store.add(note)
+                               for note in json.loads(noteList))
 
         topicDict = projectFile.readline()
         self.topics = json.loads(topicDict)
+        ordered = sorted(self.topics.values(), key=itemgetter('number'))
+        self.topicOrder = NoteList(topic['name'] for topic in ordered)
+        for topic in ordered:
+            del topic['number']
+            topic['notes'] = NoteList(self.store.add(note)
+                                      for note in topic['notes'])
+
+        # Projects that have a journal name their snapshot generation on a
+        # third line
+        meta = projectFile.readline()
+        meta = json.loads(meta) if meta.strip() else {}
+        generation = meta.get('generation')
+        self.source = meta.get('source')
+        self.restoreQueue(meta.get('cursor', 0))
+        if 'origins' in meta:
+            decodeOrigins(meta['origins']['notes'], meta['origins']['files'],
+                          range(len(self.store)), self.store.origins)
 
         projectFile.close()
 
+        for record in self.journal.replay(projectpath, generation):
+            self.applyRecord(record)
+
+        self.savedVersion = self.version
+        self.savedFilename = projectpath
+        self.savedBlocks = None
+
+    @instrument(size=lambda self, projectpath: fileSize(projectpath))
+    def openIndexedModel(self, projectpath):
+        """ Open a project from an indexed .otlb file. Only the index and the
+            note deque are read, each topic's notes are decoded when the
+            topic is first needed. """
+
+        self.reader = ProjectReader(projectpath)
+
+        self.store = NoteStore()
+        self.notes = NoteQueue(self.store.add(note) for note in
+                               self.reader.readNotes(self.reader.notes))
+        origins = self.reader.meta.get('origins')
+        if origins is not None:
+            decodeOrigins(origins['notes'], origins['files'],
+                          range(len(self.store)), self.store.origins)
+        self.topics = {}
+        for name, number, block in self.reader.topics:
+            self.topics[name] = {'name': name, 'notes': NoteList(),
+                                 'block': block}
+        self.topicOrder = NoteList(name for name, number, block in
+                                   sorted(self.reader.topics,
+                                          key=itemgetter(1)))
+        self.source = self.reader.meta.get('source')
+        self.restoreQueue(self.reader.meta.get('cursor', 0))
+
+        # Indexed projects are always saved whole
+        self.journal.invalidate()
+        self.savedVersion = self.version
+        self.savedFilename = projectpath
+        self.savedBlocks = {'filename': projectpath, 'reader': self.reader,
+                            'blocks': dict((name, (0, block)) for name, number,
+                                           block in self.reader.topics)}
+
+    def restoreQueue(self, cursor):
+        """ Store the notes of a project that was just opened, which start
+            from the current note, as they were stored when it was saved with
+            the current note at position cursor. The positions kept by the
+            journal since then still hold. """
+
+        noteids = list(self.notes)
+        if 0 < cursor < len(noteids):
+            split = len(noteids) - cursor
+            self.notes.build(noteids[split:] + noteids[:split], cursor)
+
+    def suggestionEngine(self):
+        """ Return the engine that suggests topics for notes, building it if
+            need be. Raises ImportError if NumPy is not installed. """
+
+        if self.suggestions is None:
+            self.suggestions = SuggestionEngine(self)
+        return self.suggestions
+
+    def searchIndex(self):
+        """ Return the full-text index of the notes, building it if need be. """
+
+        if self.search is None:
+            self.search = SearchIndex(self)
+        return self.search
+
+    def duplicateFinder(self, threshold=0.8, found=None):
+        """ Return a DuplicateFinder that knows every note in the model. Notes
+            in topics are checked first, so that they count as the originals
+            of unassigned notes. Duplicates among the notes in the model are
+            recorded in the dict found, if one is given. """
+
+        finder = DuplicateFinder(threshold)
+        for topic in self.orderedTopics():
+            self.loadTopic(topic)
+        ordered = chain(*([topic['notes'] for topic in self.orderedTopics()] +
+                          [self.notes]))
+
+        for noteid in ordered:
+            original = finder.check(noteid, self.noteText(noteid))
+            if original is not None and found is not None:
+                found[noteid] = original
+        return finder
+
+    def findDuplicates(self, threshold=0.8):
+        """ Return a dict mapping the id of each note that repeats an earlier
+            note to the id of that note. """
+
+        found = {}
+        self.duplicateFinder(threshold, found)
+        return found
+
+    def mergeDuplicates(self, threshold=0.8):
+        """ Discard the unassigned notes that repeat another note, and flag
+            the duplicates within topics, which are left for the user to
+            sort out. Return the number of notes discarded and flagged. """
+
+        found = self.findDuplicates(threshold)
+        unassigned = set(self.notes)
+        discarded = [noteid for noteid in found if noteid in unassigned]
+        self.discardNotes(discarded)
+
+        flagged = dict((noteid, original) for noteid, original in
+                       found.iteritems() if noteid not in unassigned)
+        self.duplicates.update(flagged)
+        return len(discarded), len(flagged)
+
+    def updateIndexes(self, change, *args):
+        """ Tell the indexes that have been built about a change to the notes,
+            by calling their method with the given name. """
+
+        for index in (self.suggestions, self.search):
+            if index is not None:
+                getattr(index, change)(*args)
+
+    @instrument()
+    def loadTopic(self, topic):
+        """ Decode the notes of the topic if they have not been yet. """
+
+        if topic.get('block') is not None:
+            topic['notes'] = NoteList(self.store.add(note) for note in
+                                      self.reader.readNotes(topic['block']))
+            topic['block'] = None
+
+            origins = self.reader.meta.get('origins')
+            if origins is not None and topic['name'] in origins['topics']:
+                decodeOrigins(origins['topics'][topic['name']],
+                              origins['files'], topic['notes'],
+                              self.store.origins)
+
+    def noteText(self, noteid):
+        """ Return the text of the note with the given id. """
+
+        return self.store.text(noteid)
+
+    def orderedTopics(self):
+        """ Return the topics in the order of the outline. """
+
+        return [self.topics[name] for name in self.topicOrder]
+
+    def noteOrigin(self, noteid):
+        """ Return the (path, line) that the note with the given id was
+            imported from, or None if it is not known. """
+
+        return self.store.origins.get(noteid)
+
+    def noteCount(self, topic):
+        """ Return the number of notes in the topic without decoding them. """
+
+        if topic.get('block') is not None:
+            return topic['block'][0]
+        return len(topic['notes'])
+
+    def adoptModel(self, other):
+        """ Take over the project that was opened by another model, so that a
+            project can be opened away from the Tk thread. """
+
+        self.closeReaders()
+        self.filename = other.filename
+        self.store = other.store
+        self.notes = other.notes
+        self.topics = other.topics
+        self.topicOrder = other.topicOrder
+        self.journal = other.journal
+        self.reader = other.reader
+        self.version = other.version
+        self.savedVersion = other.savedVersion
+        self.savedFilename = other.savedFilename
+        self.savedBlocks = other.savedBlocks
+        self.suggestions = other.suggestions
+        self.search = other.search
+        self.duplicates = other.duplicates
+        self.source = other.source
+        self.compression = other.compression
+        self.compressionLevel = other.compressionLevel
+        self.history = other.history
+
+    def closeReaders(self):
+        """ Unmap the files read by the indexed project that was open. """
+
+        if self.reader is not None:
+            self.reader.current().close()
+        if self.savedBlocks is not None:
+            self.savedBlocks['reader'].current().close()
+        self.reader = None
+        self.savedBlocks = None
+
+    def setCompression(self, compression, level=None):
+        """ Compress the .otln snapshots of the project with compression
+            ('gzip', 'lzma' or None) at level, or at the default level of the
+            compression if level is None. The next save rewrites the project
+            in the new format. Indexed projects are never compressed, so that
+            they can still be mapped. """
+
+        checkCompression(compression, level)
+        if (compression, level) == (self.compression, self.compressionLevel):
+            return
+        self.compression = compression
+        self.compressionLevel = level
+        self.journal.invalidate()
+        self.savedVersion = None
+
+    @instrument(size=lambda self: fileSize(self.filename))
     def saveModel(self):
-        """ Save the current state of the project. """
-        
+        """ Save the current state of the project. Changes are appended to the
+            project's journal, and the whole project is only rewritten when the
+            journal gets long or the project is saved under a new name. """
+
+        self.writeSave(self.prepareSave())
+
+    @instrument()
+    def prepareSave(self):
+        """ Bring the model up to date with the GUI and return a description of
+            what the next save has to write, holding its own copies of the
+            notes to write. Must be called from the Tk thread, but the result
+            can be passed to writeSave on any thread. """
+
         self.sortTopics()
         self.sortNotes()
 
-        outfile = open(self.filename, 'w')
-        outfile.write(json.dumps(list(self.notes)))
-        outfile.write("\n")
-        outfile.write(json.dumps(self.topics, default=self.handleJSON))
-        outfile.close()
+        if (self.version == self.savedVersion and
+            self.filename == self.savedFilename):
+            return {'kind': 'clean'}
+        self.savedVersion = self.version
+        self.savedFilename = self.filename
+
+        if self.filename.endswith(".otlb"):
+            # Indexed projects are always saved whole, but topics that have
+            # not changed since the last save are copied from that save
+            self.journal.invalidate()
+            notes = list(self.notes)
+            return {'kind': 'indexed', 'filename': self.filename,
+                    'notes': notes, 'cursor': self.notes.position(),
+                    'topics': self.copyIndexed(), 'store': self.store,
+                    'reader': self.reader,
+                    'source': self.copySource(self.writtenPosition)}
+        elif self.journal.needsSnapshot(self.filename):
+            for topic in self.topics.values():
+                self.loadTopic(topic)
+            # The notes are written from the current note, as they always
+            # have been, along with the position of the current note, which
+            # openModel uses to store them as they are stored now
+            notes = list(self.notes)
+            topics = self.copyTopics()
+
+            # The snapshot will be opened with its notes numbered in the order
+            # in which they are written
+            fileIds = {}
+            for noteid in notes:
+                fileIds[noteid] = len(fileIds)
+            for topic in topics:
+                for noteid in topic['notes']:
+                    fileIds[noteid] = len(fileIds)
+
+            generation = uuid.uuid4().hex
+            self.journal.begin(self.filename, generation, fileIds)
+            return {'kind': 'snapshot', 'filename': self.filename,
+                    'notes': notes, 'topics': topics, 'store': self.store,
+                    'generation': generation,
+                    'source': self.copySource(fileIds.get),
+                    'cursor': self.notes.position(),
+                    'compression': self.compression,
+                    'level': self.compressionLevel}
+        else:
+            return {'kind': 'journal', 'generation': self.journal.generation}
+
+    @instrument(size=lambda self, save, *args: fileSize(save.get('filename')))
+    def writeSave(self, save, progress=None):
+        """ Write out a save returned by prepareSave, calling progress with the
+            fraction of the save that has been written. """
+
+        try:
+            if save['kind'] == 'indexed':
+                self.writeIndexed(save)
+            elif save['kind'] == 'snapshot':
+                self.writeSnapshot(save, progress)
+            elif save['kind'] == 'journal':
+                self.journal.append(save['generation'])
+        except:
+            # The journal may no longer match the snapshot on disk
+            self.journal.invalidate()
+            self.savedVersion = None
+            raise
+
+        if progress is not None:
+            progress(1.0)
+
+    def copySource(self, fileId):
+        """ Return a copy of the source note file and offset to save. The id
+            of an unfinished last note is given as fileId(noteid), the id that
+            the note will have when the project is opened again, or None. """
+
+        if self.source is None:
+            return None
+        source = dict(self.source)
+        if source.get('note') is not None:
+            source['note'] = fileId(source['note'])
+        return source
+
+    def writtenPosition(self, noteid):
+        """ Return the position of an unassigned note among the notes as they
+            are written, from the current note, or None if it is not
+            unassigned. """
+
+        position = self.notes.find(noteid)
+        if position is None:
+            return None
+        return (position - self.notes.position()) % len(self.notes)
+
+    def copyTopics(self):
+        """ Return copies of the topics in order, whose note lists are not
+            affected by later changes to the model. """
+
+        return [dict(topic, notes=list(topic['notes']), number=number)
+                for number, topic in enumerate(self.orderedTopics())]
+
+    def copyIndexed(self):
+        """ Return copies of the topics in order for an indexed save. Topics
+            that have not been decoded, or that have not changed since the last
+            indexed save, keep the block that their notes can be copied from. """
+
+        saved = self.savedBlocks
+        topics = []
+
+        for number, topic in enumerate(self.orderedTopics()):
+            topic = dict(topic, number=number)
+            if topic.get('block') is not None:
+                topics.append(dict(topic, reader=self.reader))
+            elif (saved is not None and saved['filename'] == self.filename and
+                  saved['blocks'].get(topic['name'], (None,))[0] ==
+                  topic.get('version', 0)):
+                topics.append(dict(topic, reader=saved['reader'],
+                                   block=saved['blocks'][topic['name']][1]))
+            else:
+                topics.append(dict(topic, notes=list(topic['notes'])))
+
+        return topics
+
+    @instrument(size=lambda self, save: fileSize(save['filename']))
+    def writeIndexed(self, save):
+        """ Write an indexed project, and keep the map of the new file so that
+            topics that do not change before the next save can be copied from
+            it. """
+
+        text = save['store'].text
+        topics = save['topics']
+        meta = {'source': save['source'], 'cursor': save['cursor']}
+
+        # Each section of notes keeps the files and lines of its notes, and
+        # topics that are copied from a block keep those of the block
+        files = OrderedDict()
+        origins = save['store'].origins
+        notes = encodeOrigins(origins, save['notes'], files)
+        topicOrigins = {}
+        for topic in topics:
+            if topic.get('block') is None:
+                entries = encodeOrigins(origins, topic['notes'], files)
+            else:
+                old = (topic.get('reader') or
+                       save['reader']).meta.get('origins') or {}
+                entries = recodeOrigins(
+                    old.get('topics', {}).get(topic['name'], []),
+                    old.get('files', []), files)
+            if len(entries) > 0:
+                topicOrigins[topic['name']] = entries
+        if len(files) > 0:
+            meta['origins'] = {'files': list(files), 'notes': notes,
+                               'topics': topicOrigins}
+
+        for topic in topics:
+            if topic.get('block') is None:
+                topic['notes'] = [text(noteid) for noteid in topic['notes']]
+
+        # Maps of the old file are closed before it is replaced, and then
+        # read from the new file
+        readers = [self.reader]
+        if self.savedBlocks is not None:
+            readers.append(self.savedBlocks['reader'])
+        blocks, reader = writeProject(save['filename'],
+                                      [text(noteid) for noteid in
+                                       save['notes']],
+                                      topics, save['reader'], meta, readers)
+
+        self.savedBlocks = {'filename': save['filename'], 'reader': reader,
+                            'blocks': dict((topic['name'],
+                                            (topic.get('version', 0), block))
+                                           for topic, block in
+                                           zip(topics, blocks))}
+
+    @instrument(size=lambda self, save, *args: fileSize(save['filename']))
+    def writeSnapshot(self, save, progress=None):
+        """ Write the whole project to a temporary file, move it over the
+            project file and discard the journal of the previous snapshot.
+            The notes are encoded a batch at a time as they are written, and
+            compressed on the way out if the save asks for it, so the JSON of
+            the whole project is never held in memory. """
+
+        filename = save['filename']
+        temppath = filename + ".tmp"
+        topics = save['topics']
+        text = save['store'].text
+
+        rawfile = open(temppath, 'wb')
+        outfile = openWriter(rawfile, save.get('compression'),
+                             save.get('level'))
+        writeJSONList(outfile, (text(noteid) for noteid in save['notes']))
+        outfile.write("\n{")
+        # Topics are written one at a time to report progress as we go
+        for i, topic in enumerate(topics):
+            if i > 0:
+                outfile.write(", ")
+            fields = dict(topic)
+            notes = fields.pop('notes')
+            head = json.dumps(fields, default=self.handleJSON)[:-1]
+            outfile.write(json.dumps(topic['name']) + ": " + head +
+                          (", " if len(fields) > 0 else "") + '"notes": ')
+            writeJSONList(outfile, (text(noteid) for noteid in notes))
+            outfile.write("}")
+            if progress is not None:
+                progress(float(i + 1) / (len(topics) + 1))
+        outfile.write("}\n")
+        meta = {'generation': save['generation'], 'cursor': save['cursor']}
+        if save['source'] is not None:
+            meta['source'] = save['source']
+        # The files and lines that the notes were imported from, with the
+        # notes numbered in the order in which they were written
+        files = OrderedDict()
+        notes = encodeOrigins(save['store'].origins,
+                              chain(save['notes'],
+                                    *[topic['notes'] for topic in topics]),
+                              files)
+        if len(files) > 0:
+            meta['origins'] = {'files': list(files), 'notes': notes}
+        outfile.write(json.dumps(meta))
+        if outfile is not rawfile:
+            outfile.close()
+        rawfile.flush()
+        os.fsync(rawfile.fileno())
+        rawfile.close()
+
+        replaceFile(temppath, filename)
+        self.journal.discard(filename)
 
     def handleJSON(self, obj):
         """ Handles the JSON encoding of obj when obj would cause a TypeError. """
 
         return None
 
-    def exportModel(self, exportpath):
-        """ Create a .txt outline based off of the notes in the model. """
+    @instrument(size=lambda self, exportpath, *args: fileSize(exportpath))
+    def exportModel(self, exportpath, format=None):
+        """ Create an outline based off of the notes in the model. """
 
         try:
-            self.sortNotes()
-            self.sortTopics()
+            self.writeExport(exportpath, self.prepareExport(), format=format)
+        except IOError:
+            print "Error: no such file"
+
+    @instrument()
+    def prepareExport(self):
+        """ Bring the model up to date with the GUI and return copies of the
+            topics to export, in order. Must be called from the Tk thread. """
+
+        self.sortNotes()
+        self.sortTopics()
+
+        for topic in self.topics.values():
+            self.loadTopic(topic)
+        return {'topics': self.copyTopics(), 'store': self.store}
+
+    @instrument(size=lambda self, exportpath, *args: fileSize(exportpath))
+    def writeExport(self, exportpath, export, progress=None, format=None):
+        """ Write an export returned by prepareExport as an outline, calling
+            progress with the fraction of the outline that has been written.
+            exportpath may be a path, "-" for standard output, or an open
+            file such as a pipe. The format (see outlinerexport.RENDERERS)
+            defaults to the one given by the extension of exportpath. """
 
+        if format is None:
+            format = formatFor(exportpath if isinstance(exportpath, basestring)
+                               else "")
+
+        # Write topics in the order given by their numbers
+        topics = trackProgress(export['topics'], progress)
+        chunks = RENDERERS[format](topics, export['store'].text)
+
+        if exportpath == "-":
+            writeChunks(sys.stdout, chunks)
+            sys.stdout.flush()
+        elif not isinstance(exportpath, basestring):
+            writeChunks(exportpath, chunks)
+        else:
             outfile = open(exportpath, 'w')
-            # Write topics in the order given by their numbers
-            for topic in sorted(self.topics.values(), key=itemgetter('number')):
-                outfile.write(topic['name'] + ":\n")
-                for note in topic['notes']:
-                    outfile.write("\t" + note + "\n\n")
-                outfile.write("\n")
+            writeChunks(outfile, chunks)
             outfile.close()
-        except IOError:
-            print "Error: no such file"
+
+        if progress is not None:
+            progress(1.0)
+
+    def perform(self, record):
+        """ Apply the change described by record to the model, queue it to
+            be journaled on the next save and keep the records that undo it. """
+
+        inverse = self.inverseRecords(record)
+        self.journal.record(dict(record))
+        result = self.applyRecord(record)
+        if inverse is not None:
+            self.history.record(inverse)
+        return result
+
+    def inverseRecords(self, record):
+        """ Return the records that undo the change described by record,
+            worked out before it is applied, or None if the change is not
+            undone: moving through the notes, appending notes from the note
+            file and creating topics. """
+
+        op = record['op']
+        if op in ('remove', 'order', 'move'):
+            topic = self.topics[record['topic']]
+            self.loadTopic(topic)
+            notes = topic['notes']
+
+        if op == 'add':
+            return [{'op': 'restore', 'topic': record['topic'],
+                     'notes': [self.notes[0]],
+                     'positions': [self.notes.position()], 'current': 0}]
+        elif op == 'remove':
+            # The note is pushed in at the current note's position
+            index = notes.index(record['note'])
+            inverse = [{'op': 'assign', 'topic': record['topic'],
+                        'notes': [record['note']],
+                        'positions': [self.notes.position()]}]
+            if index != len(notes) - 1:
+                inverse.append({'op': 'move', 'topic': record['topic'],
+                                'note': record['note'], 'index': index})
+            return inverse
+        elif op in ('assign', 'discard'):
+            positions = record.get('positions')
+            if (positions is not None and
+                self.notes.holds(record['notes'], positions)):
+                found = dict(zip(record['notes'], positions))
+            else:
+                found = self.notes.positions(record['notes'])
+            noteids = [noteid for noteid in record['notes'] if noteid in found]
+            inverse = {'op': 'restore', 'notes': noteids,
+                       'positions': [found[noteid] for noteid in noteids],
+                       'topic': record.get('topic')}
+            if len(self.notes) > 0 and self.notes[0] in found:
+                inverse['current'] = noteids.index(self.notes[0])
+            return [inverse]
+        elif op == 'restore':
+            # The notes will be at the positions that they are restored to
+            inverse = {'op': 'discard', 'notes': list(record['notes']),
+                       'positions': list(record['positions'])}
+            if record.get('topic') is not None:
+                inverse.update(op='assign', topic=record['topic'])
+            return [inverse]
+        elif op == 'order':
+            end = record['start'] + len(record['notes'])
+            return [{'op': 'order', 'topic': record['topic'],
+                     'start': record['start'],
+                     'notes': notes[record['start']:end]}]
+        elif op == 'move':
+            return [{'op': 'move', 'topic': record['topic'],
+                     'note': record['note'],
+                     'index': notes.index(record['note'])}]
+        elif op == 'place':
+            return [{'op': 'place', 'topic': record['topic'],
+                     'index': self.topicOrder.index(record['topic'])}]
+        return None
+
+    def applyRecord(self, record):
+        """ Apply the change described by a journal record to the model. """
+
+        op = record['op']
+        self.version += 1
+
+        if (op in ('add', 'remove', 'order', 'assign', 'move') or
+            (op == 'restore' and record.get('topic') is not None)):
+            topic = self.topics[record['topic']]
+            self.loadTopic(topic)
+            topic['version'] = topic.get('version', 0) + 1
+
+        if op == 'add':
+            noteid = self.notes.popleft()
+            self.topics[record['topic']]['notes'].append(noteid)
+            self.updateIndexes('noteAdded', record['topic'], noteid)
+            return noteid
+        elif op == 'remove':
+            self.topics[record['topic']]['notes'].remove(record['note'])
+            self.notes.appendleft(record['note'])
+            self.updateIndexes('noteRemoved', record['topic'], record['note'])
+            return record['note']
+        elif op == 'assign':
+            self.notes.removeNotes(record['notes'], record.get('positions'))
+            notes = self.topics[record['topic']]['notes']
+            for noteid in record['notes']:
+                notes.append(noteid)
+                self.updateIndexes('noteAdded', record['topic'], noteid)
+        elif op == 'discard':
+            self.notes.removeNotes(record['notes'], record.get('positions'))
+            for noteid in record['notes']:
+                self.duplicates.pop(noteid, None)
+                self.updateIndexes('noteDiscarded', noteid)
+        elif op == 'restore':
+            if record.get('topic') is not None:
+                notes = self.topics[record['topic']]['notes']
+                for noteid in record['notes']:
+                    notes.remove(noteid)
+                    self.updateIndexes('noteRemoved', record['topic'], noteid)
+            else:
+                for noteid in record['notes']:
+                    self.updateIndexes('noteImported', noteid)
+            # Putting the notes back from the first position on puts each
+            # one back exactly where it was
+            for position, noteid in sorted(zip(record['positions'],
+                                               record['notes'])):
+                self.notes.insertAt(position, noteid)
+            if record.get('current') is not None:
+                self.notes.moveTo(record['positions'][record['current']])
+        elif op == 'import':
+            if len(record['texts']) > 0:
+                # The new notes shift the positions that the undo history
+                # refers to
+                self.history.clear()
+            noteids = []
+            for text in record['texts']:
+                noteid = self.store.add(text)
+                position = None
+                if len(noteids) == 0 and record.get('note') is not None:
+                    position = self.notes.find(record['note'])
+                if position is None:
+                    self.notes.append(noteid)
+                else:
+                    # The finished note takes the place of the unfinished
+                    # one, and stays the current note if it was
+                    current = self.notes.position() == position
+                    self.notes.removeNotes([record['note']], [position])
+                    self.updateIndexes('noteDiscarded', record['note'])
+                    self.notes.insertAt(position, noteid)
+                    if current:
+                        self.notes.moveTo(position)
+                self.updateIndexes('noteImported', noteid)
+                noteids.append(noteid)
+            self.source['offset'] = record['offset']
+            self.source['note'] = None
+            return noteids
+        elif op == 'rotate':
+            self.notes.rotate(record['steps'])
+        elif op == 'topic':
+            newTopic = {}
+            newTopic['name'] = record['name']
+            newTopic['notes'] = NoteList()
+            newTopic['block'] = None
+            newTopic['version'] = 0
+            self.topics[record['name']] = newTopic
+            self.topicOrder.append(record['name'])
+            self.updateIndexes('topicAdded', record['name'])
+            return newTopic
+        elif op == 'order':
+            notes = self.topics[record['topic']]['notes']
+            notes.replace(record['start'], record['notes'])
+        elif op == 'move':
+            self.topics[record['topic']]['notes'].move(record['note'],
+                                                       record['index'])
+        elif op == 'place':
+            self.topicOrder.move(record['topic'], record['index'])
+        elif op == 'number':
+            # Written by older versions, which renumbered every topic
+            self.topicOrder = NoteList(record['topics'])
+
+    def undo(self):
+        """ Undo the most recent change that has not been undone, and return
+            the records applied to undo it, or None if there is none. """
+
+        return self.replayHistory(self.history.takeUndo(), 'undo')
+
+    def redo(self):
+        """ Redo the most recently undone change, and return the records
+            applied to redo it, or None if there is none. """
+
+        return self.replayHistory(self.history.takeRedo(), 'redo')
+
+    def replayHistory(self, records, target):
+        """ Perform the records of a step taken from the undo history, while
+            the records that reverse them are collected into a step on the
+            other stack. """
+
+        if records is None:
+            return None
+
+        self.history.begin(target)
+        try:
+            for record in records:
+                self.perform(record)
+        finally:
+            self.history.end()
+        return records
 
     def newTopic(self, topicName):
         """ Create a new topic with the given name. """
 
-        newTopic = {}
-        newTopic['name'] = topicName
-        newTopic['notes'] = []
-        newTopic['number'] = len(self.topics.keys())
-        self.topics[topicName] = newTopic
+        return self.perform({'op': 'topic', 'name': topicName})
 
     def addNoteToTopic(self, topic):
-        """ Add the currently-displayed note to the topic, return that note. """
+        """ Add the currently-displayed note to the topic, return its id. """
 
-        try:
-            note = self.notes.popleft()
-            topic['notes'].append(note)
-            return note
-        except IndexError:
+        if len(self.notes) == 0:
             print "Error: tried to pop empty notes deque"
             return None
 
+        return self.perform({'op': 'add', 'topic': topic['name']})
+
+    def assignNotes(self, topic, noteids):
+        """ Move the unassigned notes with the given ids to the end of the
+            topic, in the order given, in a single pass over the note deque. """
+
+        if len(noteids) > 0:
+            self.perform({'op': 'assign', 'topic': topic['name'],
+                          'notes': list(noteids)})
+
+    def discardNotes(self, noteids):
+        """ Drop the unassigned notes with the given ids from the project. """
+
+        if len(noteids) > 0:
+            self.perform({'op': 'discard', 'notes': list(noteids)})
+
+    def removeNoteFromTopic(self, topic, noteid):
+        """ Remove the note with the given id from the topic and push it onto
+            the left of the note deque. """
+
+        self.perform({'op': 'remove', 'topic': topic['name'], 'note': noteid})
+
+    def nextNote(self):
+        """ Move the current note to the back of the note deque. """
+
+        self.perform({'op': 'rotate', 'steps': -1})
+
+    def prevNote(self):
+        """ Move the last note to the front of the note deque. """
+
+        self.perform({'op': 'rotate', 'steps': 1})
+
+    def rotateToNote(self, noteid):
+        """ Rotate the note deque so that the unassigned note with the given id
+            is the current note. """
+
+        position = self.notes.find(noteid)
+        if position is not None:
+            self.jumpToNote(position)
+
+    def jumpToNote(self, position):
+        """ Make the unassigned note at position (counted from 0, as given by
+            notePosition) the current note. """
+
+        steps = self.notes.position() - position % max(len(self.notes), 1)
+        if steps != 0:
+            self.perform({'op': 'rotate', 'steps': steps})
+
+    def notePosition(self):
+        """ Return the position of the current note among the unassigned
+            notes, counted from 0. Moving to the next note adds one. """
+
+        return self.notes.position()
+
+    def reorderNotes(self, topic, notes, start=0):
+        """ Rearrange the notes of the topic starting at index start into the
+            order given by the list of note ids notes. """
+
+        end = start + len(notes)
+        if topic['notes'][start:end] != notes:
+            self.perform({'op': 'order', 'topic': topic['name'],
+                          'start': start, 'notes': notes})
+
+    def moveNote(self, topic, noteid, index):
+        """ Move the note with the given id to position index in the topic. """
+
+        if topic['notes'].index(noteid) != index:
+            self.perform({'op': 'move', 'topic': topic['name'],
+                          'note': noteid, 'index': index})
+
+    def moveTopic(self, topic, index):
+        """ Move the topic to position index in the outline. """
+
+        if self.topicOrder.index(topic['name']) != index:
+            self.perform({'op': 'place', 'topic': topic['name'],
+                          'index': index})
+
+    def topicNumber(self, topic):
+        """ Return the position of the topic in the outline. """
+
+        return self.topicOrder.index(topic['name'])
+
     def sortNotes(self):
-        """ Sort the notes in each topic according to the order in which they 
-            are currently arranged. """
+        """ Move the notes that have been dropped in the GUI but not moved in
+            the model yet. """
 
-        self.outliner.sortNotes()
+        if self.outliner is not None:
+            self.outliner.sortNotes()
 
     def sortTopics(self):
-        """ Assign numbers to topics according to the order in which they are
-            currently assigned. """
+        """ Move the topics that have been dropped in the GUI but not moved
+            in the model yet. """
+
+        if self.outliner is not None:
+            self.outliner.sortTopics()
+
+
+def writeJSONList(outfile, items, batch=1024):
+    """ Write items to outfile as a JSON list, encoding batch of them at a
+        time. """
+
+    outfile.write("[")
+    pending = []
+    first = True
+    for item in items:
+        pending.append(json.dumps(item))
+        if len(pending) == batch:
+            outfile.write(("" if first else ", ") + ", ".join(pending))
+            pending = []
+            first = False
+    if len(pending) > 0:
+        outfile.write(("" if first else ", ") + ", ".join(pending))
+    outfile.write("]")
+
+def convertProject(inpath, outpath, compression=False, level=None):
+    """ Convert the project at inpath to the format given by the extension of
+        outpath (.otlb for an indexed project, otherwise .otln). A .otln
+        project is compressed with compression ('gzip', 'lzma' or None) at
+        level, or keeps the compression of the project at inpath if
+        compression is False. """
 
-        self.outliner.sortTopics()
+    model = OutlinerModel(None)
+    model.openModel(inpath)
+    if compression is not False and not outpath.endswith(".otlb"):
+        model.setCompression(compression, level)
+    model.filename = outpath
+    model.saveModel()
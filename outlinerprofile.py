@@ -0,0 +1,184 @@
+"""
+ "  File: outlinerprofile.py
+ "  Written By: Gregory Owen
+ "
+ "  Opt-in instrumentation of the Outliner's actions and I/O. Set the
+ "  environment variable OUTLINER_PROFILE to "stats" to count and time calls,
+ "  "cprofile" to also profile every function, or "tracemalloc" to also track
+ "  memory where the tracemalloc module is available. The statistics are
+ "  written to OUTLINER_PROFILE_FILE (default outliner-profile.json) on exit.
+"""
+
+from functools import wraps
+import atexit
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+MODES = ('stats', 'cprofile', 'tracemalloc')
+
+class Profiler():
+    """ Collects the number of calls, wall time and sizes of the notes and
+        files handled by each instrumented method while it is enabled. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.mode = None
+        self.path = None
+        self.profile = None
+        self.started = None
+        self.stats = {}
+
+    def start(self, mode='stats', path=None):
+        """ Start recording, and dump the statistics to path on exit. """
+
+        if mode not in MODES:
+            raise ValueError("Unknown profiling mode: %s" % mode)
+        if mode == 'tracemalloc' and tracemalloc is None:
+            raise ValueError("The tracemalloc module is not available")
+
+        if self.path is None:
+            atexit.register(self.dump)
+        self.path = path or "outliner-profile.json"
+        self.mode = mode
+        self.started = time.time()
+        self.enabled = True
+
+        if mode == 'cprofile':
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        elif mode == 'tracemalloc':
+            tracemalloc.start()
+
+    def stop(self):
+        """ Stop recording, keeping the statistics collected so far. """
+
+        self.enabled = False
+        if self.profile is not None:
+            self.profile.disable()
+        if self.mode == 'tracemalloc' and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def reset(self):
+        """ Forget the statistics collected so far. """
+
+        with self.lock:
+            self.stats = {}
+        self.started = time.time()
+
+    def add(self, name, seconds, notes=None, size=None):
+        """ Record one call of the named method. """
+
+        with self.lock:
+            stat = self.stats.get(name)
+            if stat is None:
+                stat = self.stats[name] = {'calls': 0, 'seconds': 0.0,
+                                           'max': 0.0}
+            stat['calls'] += 1
+            stat['seconds'] += seconds
+            stat['max'] = max(stat['max'], seconds)
+            if notes is not None:
+                stat['notes'] = notes
+            if size is not None:
+                stat['bytes'] = stat.get('bytes', 0) + size
+
+    def rows(self):
+        """ Return (name, stat) pairs, the most time-consuming first. """
+
+        with self.lock:
+            rows = [(name, dict(stat)) for name, stat in self.stats.items()]
+        return sorted(rows, key=lambda row: -row[1]['seconds'])
+
+    def dump(self, path=None):
+        """ Write the statistics to path as JSON, with the cProfile output or
+            the largest memory allocations next to it if they are being
+            captured. Return the path written to. """
+
+        path = path or self.path
+        if path is None:
+            return None
+
+        report = {'mode': self.mode, 'seconds': time.time() - self.started,
+                  'methods': dict(self.rows())}
+
+        if self.mode == 'tracemalloc' and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            report['allocations'] = [
+                {'where': str(stat.traceback), 'bytes': stat.size,
+                 'count': stat.count}
+                for stat in snapshot.statistics('lineno')[:50]]
+
+        outfile = open(path, 'w')
+        json.dump(report, outfile, indent=2, sort_keys=True)
+        outfile.close()
+
+        if self.profile is not None:
+            self.profile.create_stats()
+            pstats.Stats(self.profile).dump_stats(
+                os.path.splitext(path)[0] + ".pstats")
+        return path
+
+PROFILER = Profiler()
+
+def startFromEnvironment():
+    """ Start the profiler if OUTLINER_PROFILE asks for it. """
+
+    mode = os.environ.get("OUTLINER_PROFILE")
+    if mode:
+        try:
+            PROFILER.start(mode, os.environ.get("OUTLINER_PROFILE_FILE"))
+        except ValueError as error:
+            print "Error: %s" % error
+
+def fileSize(path):
+    """ Return the size of the file at path, or None if there is none. """
+
+    if isinstance(path, basestring) and os.path.isfile(path):
+        return os.path.getsize(path)
+    return None
+
+def countNotes(obj):
+    """ Return the number of notes in the project of a model, or of the
+        Outliner or GUI that obj is, or None. """
+
+    store = getattr(getattr(obj, 'model', obj), 'store', None)
+    return len(store) if store is not None else None
+
+def instrument(size=None):
+    """ Decorator that records calls of a method with PROFILER when it is
+        enabled, along with the number of notes in the project. If size is
+        given, it is called with the method's arguments after the call and
+        returns the number of bytes that the call read or wrote. """
+
+    def decorate(method):
+        name = method.__name__
+
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not PROFILER.enabled:
+                return method(self, *args, **kwargs)
+
+            start = time.time()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                seconds = time.time() - start
+                try:
+                    noteCount = countNotes(self)
+                    byteCount = size(self, *args) if size else None
+                except Exception:
+                    noteCount = byteCount = None
+                PROFILER.add("%s.%s" % (self.__class__.__name__, name),
+                             seconds, noteCount, byteCount)
+
+        return wrapper
+    return decorate
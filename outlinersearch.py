@@ -0,0 +1,192 @@
+"""
+ "  File: outlinersearch.py
+ "  Written By: Gregory Owen
+ "
+ "  Full-text search over every note in a project, and lookup of topics by
+ "  name
+"""
+
+from bisect import bisect_left, insort
+import re
+
+WORD = re.compile(r"\w+", re.UNICODE)
+TERM = re.compile(r'"([^"]*)"|(\S+)')
+
+def tokenize(text):
+    """ Return the lower-case words of text, in order. """
+
+    if not isinstance(text, unicode):
+        text = text.decode('utf-8', 'replace')
+    return WORD.findall(text.lower())
+
+class SearchIndex():
+    """ An inverted index from each word to the notes that contain it and its
+        positions in them, which also knows which topic (if any) each note is
+        in. Words are kept in sorted order for prefix queries.
+
+        A query is a list of terms that must all match. A term is a word, a
+        word followed by * to match every word starting with it, or several
+        words in double quotes to match them as a phrase. """
+
+    def __init__(self, model):
+        self.model = model
+        # word -> {noteid: [positions of the word in the note]}
+        self.postings = {}
+        # Sorted words, and words indexed since they were last sorted
+        self.words = []
+        self.newWords = []
+        # noteid -> name of the topic containing the note, or None
+        self.location = {}
+
+        for noteid in model.notes:
+            self.noteImported(noteid)
+        for topic in model.topics.values():
+            model.loadTopic(topic)
+            for noteid in topic['notes']:
+                self.noteImported(noteid)
+                self.location[noteid] = topic['name']
+
+    def noteImported(self, noteid):
+        """ Index the words of a new, unassigned note. """
+
+        for position, word in enumerate(tokenize(self.model.noteText(noteid))):
+            if word not in self.postings:
+                self.postings[word] = {}
+                self.newWords.append(word)
+            self.postings[word].setdefault(noteid, []).append(position)
+        self.location[noteid] = None
+
+    def noteDiscarded(self, noteid):
+        """ Forget a note that has been dropped from the project. """
+
+        for word in set(tokenize(self.model.noteText(noteid))):
+            self.postings[word].pop(noteid, None)
+        self.location.pop(noteid, None)
+
+    def topicAdded(self, name):
+        """ New topics are empty, so nothing needs to be indexed. """
+
+        pass
+
+    def noteAdded(self, name, noteid):
+        """ Record that the note is now in the named topic. """
+
+        self.location[noteid] = name
+
+    def noteRemoved(self, name, noteid):
+        """ Record that the note is unassigned again. """
+
+        self.location[noteid] = None
+
+    def completions(self, prefix):
+        """ Yield the indexed words that start with prefix. """
+
+        if len(self.newWords) > 0:
+            self.words.extend(self.newWords)
+            self.words.sort()
+            self.newWords = []
+
+        i = bisect_left(self.words, prefix)
+        while i < len(self.words) and self.words[i].startswith(prefix):
+            yield self.words[i]
+            i += 1
+
+    def occurrences(self, word, prefix=False):
+        """ Return a dict mapping the ids of the notes containing word (or, if
+            prefix is True, any word starting with it) to its positions. """
+
+        if not prefix:
+            return self.postings.get(word, {})
+
+        merged = {}
+        for completion in self.completions(word):
+            for noteid, positions in self.postings[completion].iteritems():
+                merged.setdefault(noteid, []).extend(positions)
+        return merged
+
+    def match(self, words, prefix=False):
+        """ Return the set of ids of the notes containing words one after
+            another. If prefix is True, the last word may be the start of a
+            longer word. """
+
+        if len(words) == 0:
+            return set()
+
+        found = [self.occurrences(word, prefix and i == len(words) - 1)
+                 for i, word in enumerate(words)]
+        notes = set(min(found, key=len))
+        for occurrences in found:
+            notes.intersection_update(occurrences)
+        if len(words) == 1:
+            return notes
+
+        matches = set()
+        for noteid in notes:
+            starts = set(found[0][noteid])
+            for i, occurrences in enumerate(found[1:], 1):
+                starts.intersection_update(position - i for position in
+                                           occurrences[noteid])
+            if len(starts) > 0:
+                matches.add(noteid)
+        return matches
+
+    def search(self, query):
+        """ Return the ids of the notes that match every term of query, in the
+            order in which they were imported. """
+
+        result = None
+        for phrase, word in TERM.findall(query):
+            prefix = phrase == "" and word.endswith("*")
+            words = tokenize(phrase or word.rstrip("*"))
+            if len(words) == 0:
+                continue
+
+            notes = self.match(words, prefix)
+            result = notes if result is None else result & notes
+            if len(result) == 0:
+                break
+
+        return sorted(result) if result is not None else []
+
+
+class TopicIndex():
+    """ A sorted index over topic names for finding topics as their names are
+        typed. Each name is indexed from the start of each of its words, so
+        "cli" finds both "Climate" and "Effects of climate". """
+
+    def __init__(self, names=()):
+        # (lower-case name from the start of a word, name), sorted
+        self.keys = []
+        self.names = set()
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        """ Add a topic name to the index. """
+
+        if name in self.names:
+            return
+        self.names.add(name)
+
+        lower = name.lower()
+        starts = set([0]) | set(match.start() for match in
+                                WORD.finditer(lower))
+        for start in starts:
+            insort(self.keys, (lower[start:], name))
+
+    def matches(self, query, limit=50):
+        """ Return up to limit names with a word that starts with query, in
+            alphabetical order of the matching text. """
+
+        query = query.lower().strip()
+        found = []
+        seen = set()
+        i = bisect_left(self.keys, (query,))
+        while (i < len(self.keys) and len(found) < limit and
+               self.keys[i][0].startswith(query)):
+            name = self.keys[i][1]
+            if name not in seen:
+                seen.add(name)
+                found.append(name)
+            i += 1
+        return found
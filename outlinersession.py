@@ -0,0 +1,121 @@
+"""
+ "  File: outlinersession.py
+ "  Written By: Gregory Owen
+ "
+ "  Remembers the last project between runs of the Outliner, along with a
+ "  small preview of it that can be shown while the project is loading
+"""
+
+import json
+import os
+
+from outlinerjournal import replaceFile
+
+class Session():
+    """ Settings and a cached preview of the last project, kept in a JSON file
+        in the user's home directory. The preview is only cached while the
+        last project is to be reopened on startup. It holds the current note
+        and the name and size of each topic, along with the size and
+        modification time of the project and its journal, so that it is only
+        used while the project is unchanged on disk. """
+
+    def __init__(self, path=None, maxTopics=500):
+        if path is None:
+            path = os.path.join(os.path.expanduser("~"), ".outliner",
+                                "session.json")
+        self.path = path
+        self.maxTopics = maxTopics
+
+        try:
+            infile = open(path, 'r')
+            self.data = json.load(infile)
+            infile.close()
+        except (IOError, ValueError):
+            self.data = {}
+
+    def write(self):
+        """ Write the session file. Failing to is not worth reporting. """
+
+        try:
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            outfile = open(self.path + ".tmp", 'w')
+            json.dump(self.data, outfile)
+            outfile.close()
+            replaceFile(self.path + ".tmp", self.path)
+        except (IOError, OSError):
+            pass
+
+    def reopenLast(self):
+        """ Return True if the last project should be reopened on startup. """
+
+        return self.data.get('reopenLast', False)
+
+    def setReopenLast(self, reopen):
+        """ Choose whether to reopen the last project on startup. """
+
+        self.data['reopenLast'] = reopen
+        if not reopen:
+            self.forgetPreview()
+        self.write()
+
+    def fileStamp(self, projectpath):
+        """ Return the size and modification time of the project and of its
+            journal, which change whenever the project is saved. """
+
+        stamp = []
+        for path in (projectpath, projectpath + ".journal"):
+            if os.path.exists(path):
+                info = os.stat(path)
+                stamp.extend([info.st_size, info.st_mtime])
+            else:
+                stamp.extend([None, None])
+        return stamp
+
+    def remember(self, model):
+        """ Remember the model's file, and cache a preview of the model, which
+            must match its file on disk. The preview holds the text of a note
+            and the names of topics, so it is only kept while the last project
+            is to be reopened on startup. """
+
+        if model.filename is None:
+            return
+
+        self.data['project'] = os.path.abspath(model.filename)
+        if not self.reopenLast():
+            self.forgetPreview()
+            self.write()
+            return
+
+        topics = model.orderedTopics()
+        self.data['stamp'] = self.fileStamp(model.filename)
+        self.data['note'] = (model.noteText(model.notes[0])
+                             if len(model.notes) > 0 else None)
+        self.data['notes'] = len(model.notes)
+        self.data['topics'] = [[topic['name'], model.noteCount(topic)]
+                               for topic in topics[:self.maxTopics]]
+        self.data['moreTopics'] = max(0, len(topics) - self.maxTopics)
+        self.write()
+
+    def forgetPreview(self):
+        """ Drop the cached preview of the last project. """
+
+        for key in ('stamp', 'note', 'notes', 'topics', 'moreTopics'):
+            self.data.pop(key, None)
+
+    def lastProject(self):
+        """ Return the path of the last project if it still exists. """
+
+        path = self.data.get('project')
+        if path is not None and os.path.exists(path):
+            return path
+        return None
+
+    def preview(self):
+        """ Return the cached preview of the last project, or None if it has
+            changed since the preview was cached. """
+
+        path = self.lastProject()
+        if path is None or self.data.get('stamp') != self.fileStamp(path):
+            return None
+        return self.data
@@ -0,0 +1,450 @@
+"""
+ "  File: outlinerstore.py
+ "  Written By: Gregory Owen
+ "
+ "  Storage for notes, which the rest of the Outliner refers to by id
+"""
+
+class NoteStore():
+    """ Holds the text of every note exactly once, under a stable integer id.
+        Two notes with the same text get different ids. """
+
+    def __init__(self):
+        self.texts = []
+        # Note id -> (path, line) of the file that the note was imported
+        # from, for the notes that know where they came from
+        self.origins = {}
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, text, origin=None):
+        """ Store a new note with the given text, and the (path, line) that it
+            was read from if known, and return its id. """
+
+        self.texts.append(text)
+        if origin is not None:
+            self.origins[len(self.texts) - 1] = origin
+        return len(self.texts) - 1
+
+    def text(self, noteid):
+        """ Return the text of the note with the given id. """
+
+        return self.texts[noteid]
+
+
+class BlockList():
+    """ A list of ids kept in blocks of about blockSize ids, with a Fenwick
+        tree over the lengths of the blocks, so that finding the id at a
+        position takes O(log n), and inserting or removing an id only shifts
+        the ids in one block. """
+
+    def __init__(self, noteids=(), blockSize=512):
+        self.blockSize = blockSize
+        self.build(list(noteids))
+
+    def build(self, noteids):
+        """ Fill the list with noteids, in O(n). """
+
+        size = self.blockSize
+        self.blocks = [noteids[i:i + size]
+                       for i in range(0, len(noteids), size)] or [[]]
+        self.size = len(noteids)
+        self.rebuildTree()
+
+    def rebuildTree(self):
+        """ Recount the ids in the blocks after blocks were split or
+            removed. """
+
+        # tree[i] counts the ids in the lowbit(i) blocks ending at block i - 1
+        self.tree = [0] + [len(block) for block in self.blocks]
+        for i in range(1, len(self.tree)):
+            parent = i + (i & -i)
+            if parent < len(self.tree):
+                self.tree[parent] += self.tree[i]
+        # The block last found by locate and the position of its first id
+        self.found = None
+
+    def __len__(self):
+        return self.size
+
+    def update(self, block, delta):
+        """ Add delta to the count of ids in block. """
+
+        i = block + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+        self.found = None
+
+    def prefix(self, block):
+        """ Return the number of ids in the blocks before block. """
+
+        count = 0
+        while block > 0:
+            count += self.tree[block]
+            block -= block & -block
+        return count
+
+    def locate(self, position):
+        """ Return the block holding the id at position and its offset in
+            that block. Stepping through neighbouring positions takes O(1). """
+
+        if self.found is not None:
+            block, start = self.found
+            if start <= position < start + len(self.blocks[block]):
+                return block, position - start
+            if (position == start + len(self.blocks[block]) and
+                block + 1 < len(self.blocks)):
+                self.found = (block + 1, position)
+                return block + 1, 0
+
+        block = 0
+        remaining = position + 1
+        step = 1
+        while step * 2 < len(self.tree):
+            step *= 2
+        while step > 0:
+            if (block + step < len(self.tree) and
+                self.tree[block + step] < remaining):
+                block += step
+                remaining -= self.tree[block]
+            step /= 2
+
+        self.found = (block, position + 1 - remaining)
+        return block, remaining - 1
+
+    def window(self, start, count):
+        """ Return a list of up to count ids, starting at position start. """
+
+        ids = []
+        if count <= 0 or start >= self.size:
+            return ids
+
+        block, offset = self.locate(start)
+        while len(ids) < count and block < len(self.blocks):
+            ids.extend(self.blocks[block][offset:offset + count - len(ids)])
+            block += 1
+            offset = 0
+        return ids
+
+    def insert(self, position, noteid):
+        """ Insert an id before the id at position, or at the end if position
+            is len(self). """
+
+        if position >= self.size:
+            block, offset = len(self.blocks) - 1, len(self.blocks[-1])
+        else:
+            block, offset = self.locate(position)
+        self.blocks[block].insert(offset, noteid)
+        self.size += 1
+        self.update(block, 1)
+        self.placed(block, [noteid])
+
+        if len(self.blocks[block]) > 2 * self.blockSize:
+            # Split the block in place, so that its first half stays the
+            # same list
+            half = len(self.blocks[block]) / 2
+            self.blocks.insert(block + 1, self.blocks[block][half:])
+            del self.blocks[block][half:]
+            self.rebuildTree()
+            self.placed(block + 1, self.blocks[block + 1])
+
+    def delete(self, position):
+        """ Remove and return the id at position. """
+
+        block, offset = self.locate(position)
+        noteid = self.blocks[block].pop(offset)
+        self.size -= 1
+        self.update(block, -1)
+        self.placed(None, [noteid])
+
+        if len(self.blocks[block]) == 0 and len(self.blocks) > 1:
+            del self.blocks[block]
+            self.rebuildTree()
+        return noteid
+
+    def placed(self, block, noteids):
+        """ Called when noteids have been put into block, or removed from the
+            list if block is None. """
+
+        pass
+
+
+class NoteList(BlockList):
+    """ An ordered list of distinct ids: the notes of a topic, or the names of
+        the topics in a project. Each id remembers its block, so that finding
+        the position of an id, and moving, inserting or removing an id, take
+        O(log n) plus the time to shift the ids in one block. """
+
+    def __init__(self, noteids=(), blockSize=256):
+        BlockList.__init__(self, noteids, blockSize)
+
+    def build(self, noteids):
+        """ Fill the list with noteids, in O(n). """
+
+        BlockList.build(self, noteids)
+        self.blockOf = {}
+        for block in self.blocks:
+            for noteid in block:
+                self.blockOf[noteid] = block
+
+    def rebuildTree(self):
+        """ Recount the ids in the blocks, and renumber the blocks. """
+
+        BlockList.rebuildTree(self)
+        self.blockNumber = dict((id(block), number) for number, block in
+                                enumerate(self.blocks))
+
+    def placed(self, block, noteids):
+        """ Remember the block that each of noteids is now in. """
+
+        if block is None:
+            for noteid in noteids:
+                del self.blockOf[noteid]
+        else:
+            for noteid in noteids:
+                self.blockOf[noteid] = self.blocks[block]
+
+    def __iter__(self):
+        for block in self.blocks:
+            for noteid in block:
+                yield noteid
+
+    def __contains__(self, noteid):
+        return noteid in self.blockOf
+
+    def __getitem__(self, index):
+        """ Return the id at a position, or a list of the ids in a slice. """
+
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return list(self)[index]
+            return self.window(start, stop - start)
+
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("note index out of range")
+        block, offset = self.locate(index)
+        return self.blocks[block][offset]
+
+    def index(self, noteid):
+        """ Return the position of the given id. """
+
+        block = self.blockOf[noteid]
+        return (self.prefix(self.blockNumber[id(block)]) +
+                block.index(noteid))
+
+    def append(self, noteid):
+        """ Add an id to the end of the list. """
+
+        self.insert(self.size, noteid)
+
+    def remove(self, noteid):
+        """ Remove the given id from the list. """
+
+        self.delete(self.index(noteid))
+
+    def pop(self, index=-1):
+        """ Remove and return the id at position index. """
+
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("pop index out of range")
+        return self.delete(index)
+
+    def move(self, noteid, index):
+        """ Move the given id to position index. """
+
+        self.delete(self.index(noteid))
+        self.insert(index, noteid)
+
+    def replace(self, start, noteids):
+        """ Rearrange the ids starting at position start into the order given
+            by noteids, which must be the same ids. """
+
+        position = start
+        for noteid in noteids:
+            block, offset = self.locate(position)
+            self.blocks[block][offset] = noteid
+            self.blockOf[noteid] = self.blocks[block]
+            position += 1
+
+
+class NoteQueue(BlockList):
+    """ The unassigned notes, as a ring with a cursor at the current note.
+        Indexing and iterating start from the current note, just like a deque
+        that is rotated to bring the current note to its front, but moving
+        the cursor takes O(1) rather than a rotation. Finding the note at a
+        position takes O(log n), and inserting or removing a note only shifts
+        the ids in one block. """
+
+    def __init__(self, noteids=(), blockSize=512):
+        self.cursor = 0
+        BlockList.__init__(self, noteids, blockSize)
+
+    def build(self, noteids, cursor=0):
+        """ Fill the queue with noteids, in O(n). """
+
+        BlockList.build(self, noteids)
+        self.cursor = cursor
+
+    def __iter__(self):
+        if self.size == 0:
+            return
+        block, offset = self.locate(self.cursor)
+        for noteid in self.blocks[block][offset:]:
+            yield noteid
+        for other in self.blocks[block + 1:] + self.blocks[:block]:
+            for noteid in other:
+                yield noteid
+        for noteid in self.blocks[block][:offset]:
+            yield noteid
+
+    def __getitem__(self, index):
+        """ Return the note index places after the current note. """
+
+        if index < -self.size or index >= self.size:
+            raise IndexError("note index out of range")
+        block, offset = self.locate((self.cursor + index) % self.size)
+        return self.blocks[block][offset]
+
+    def stored(self):
+        """ Return the notes in the order in which they are stored, starting
+            from position 0 rather than from the current note. """
+
+        return [noteid for block in self.blocks for noteid in block]
+
+    def position(self):
+        """ Return the position of the current note, counted from 0. """
+
+        return self.cursor
+
+    def moveTo(self, position):
+        """ Make the note at position the current note. """
+
+        if self.size > 0:
+            self.cursor = position % self.size
+
+    def rotate(self, steps):
+        """ Move the cursor as deque.rotate(steps) would move the notes: -1
+            makes the next note the current note. """
+
+        if self.size > 0:
+            self.cursor = (self.cursor - steps) % self.size
+
+    def popleft(self):
+        """ Remove and return the current note. The note after it becomes the
+            current note. """
+
+        if self.size == 0:
+            raise IndexError("pop from an empty queue")
+        noteid = self.delete(self.cursor)
+        if self.cursor == self.size:
+            self.cursor = 0
+        return noteid
+
+    def appendleft(self, noteid):
+        """ Insert a note before the current note and make it the current
+            note. """
+
+        self.insert(self.cursor, noteid)
+
+    def append(self, noteid):
+        """ Insert a note at the back of the ring, just before the current
+            note, without changing the current note. """
+
+        if self.cursor == 0:
+            self.insert(self.size, noteid)
+        else:
+            self.insert(self.cursor, noteid)
+            self.cursor += 1
+
+    def extend(self, noteids):
+        """ Append each of noteids in turn. """
+
+        for noteid in noteids:
+            self.append(noteid)
+
+    def insertAt(self, position, noteid):
+        """ Insert a note at position (counted from the start of the blocks)
+            without changing the current note. """
+
+        self.insert(position, noteid)
+        if self.size > 1 and position <= self.cursor:
+            self.cursor += 1
+
+    def holds(self, noteids, positions):
+        """ Return True if each of noteids is at the matching position (counted
+            from the start of the blocks). """
+
+        if len(noteids) != len(positions):
+            return False
+        for noteid, position in zip(noteids, positions):
+            if position >= self.size:
+                return False
+            block, offset = self.locate(position)
+            if self.blocks[block][offset] != noteid:
+                return False
+        return True
+
+    def positions(self, noteids):
+        """ Return a dict mapping each of noteids that is in the queue to its
+            position (counted from the start of the blocks), in a single
+            pass. """
+
+        wanted = set(noteids)
+        found = {}
+        position = 0
+        for block in self.blocks:
+            for noteid in block:
+                if noteid in wanted:
+                    found[noteid] = position
+                position += 1
+        return found
+
+    def removeNotes(self, noteids, positions=None):
+        """ Remove the notes with the given ids in a single pass, keeping the
+            order of the rest. If the current note is removed, the next note
+            that is kept becomes the current note. If positions gives the
+            position of each note, the notes are removed in O(log n) each
+            instead, as long as they are still there. """
+
+        if positions is not None and self.holds(noteids, positions):
+            for position in sorted(positions, reverse=True):
+                self.delete(position)
+                if position < self.cursor:
+                    self.cursor -= 1
+            if self.cursor >= self.size:
+                self.cursor = 0
+            return
+
+        removed = set(noteids)
+        kept = []
+        cursor = None
+        position = 0
+        for block in self.blocks:
+            for noteid in block:
+                if cursor is None and position >= self.cursor:
+                    cursor = len(kept)
+                if noteid not in removed:
+                    kept.append(noteid)
+                position += 1
+
+        if cursor is None or cursor >= len(kept):
+            cursor = 0
+        self.build(kept, cursor)
+
+    def find(self, noteid):
+        """ Return the position (counted from the start of the blocks) of the
+            note with the given id, or None if it is not in the queue. """
+
+        start = 0
+        for block in self.blocks:
+            if noteid in block:
+                return start + block.index(noteid)
+            start += len(block)
+        return None
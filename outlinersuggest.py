@@ -0,0 +1,163 @@
+"""
+ "  File: outlinersuggest.py
+ "  Written By: Gregory Owen
+ "
+ "  Suggests topics for unassigned notes by comparing hashed TF-IDF vectors of
+ "  the notes with the centroid of each topic's notes. Requires NumPy.
+"""
+
+from collections import defaultdict
+import re
+import zlib
+
+# NumPy is imported when the first engine is built, to keep it out of startup
+numpy = None
+
+WORD = re.compile(r"\w+", re.UNICODE)
+
+class SuggestionEngine():
+    """ Keeps the sum of the term vectors of the notes in each topic, updated
+        as notes are added to and removed from topics, and scores notes
+        against every topic at once with a matrix multiply. Words are hashed
+        into a fixed number of dimensions, so no vocabulary has to be kept. """
+
+    def __init__(self, model, dimension=1 << 13, batchsize=1024):
+        global numpy
+        if numpy is None:
+            try:
+                import numpy
+            except ImportError:
+                raise ImportError("Topic suggestions require NumPy")
+
+        self.model = model
+        self.dimension = dimension
+        self.batchsize = batchsize
+
+        # Sparse term vector (columns, counts) of each note, by note id
+        self.vectors = {}
+        # Number of notes containing each hashed word
+        self.df = numpy.zeros(dimension)
+        self.noteCount = 0
+
+        # Row of self.centroids for each topic
+        self.rows = {}
+        self.names = []
+        self.centroids = numpy.zeros((0, dimension))
+
+        for topic in model.topics.values():
+            model.loadTopic(topic)
+            for noteid in topic['notes']:
+                self.noteImported(noteid)
+        for noteid in model.notes:
+            self.noteImported(noteid)
+        for topic in model.topics.values():
+            self.topicAdded(topic['name'])
+            for noteid in topic['notes']:
+                self.noteAdded(topic['name'], noteid)
+
+    def vector(self, noteid):
+        """ Return the sparse term vector of the note with the given id. """
+
+        if noteid not in self.vectors:
+            counts = defaultdict(int)
+            for word in WORD.findall(self.model.noteText(noteid).lower()):
+                if isinstance(word, unicode):
+                    word = word.encode('utf-8')
+                counts[zlib.crc32(word) & (self.dimension - 1)] += 1
+            self.vectors[noteid] = (numpy.array(counts.keys(), dtype=int),
+                                    numpy.array(counts.values(), dtype=float))
+        return self.vectors[noteid]
+
+    def noteImported(self, noteid):
+        """ Count the words of a new note in the document frequencies. """
+
+        columns, counts = self.vector(noteid)
+        self.df[columns] += 1
+        self.noteCount += 1
+
+    def noteDiscarded(self, noteid):
+        """ Stop counting the words of a note dropped from the project. """
+
+        columns, counts = self.vector(noteid)
+        self.df[columns] -= 1
+        self.noteCount -= 1
+
+    def topicAdded(self, name):
+        """ Add an empty centroid for a new topic. """
+
+        self.rows[name] = len(self.names)
+        self.names.append(name)
+        self.centroids = numpy.vstack([self.centroids,
+                                       numpy.zeros((1, self.dimension))])
+
+    def noteAdded(self, name, noteid):
+        """ Add a note to the centroid of the named topic. """
+
+        columns, counts = self.vector(noteid)
+        self.centroids[self.rows[name], columns] += counts
+
+    def noteRemoved(self, name, noteid):
+        """ Remove a note from the centroid of the named topic. """
+
+        columns, counts = self.vector(noteid)
+        self.centroids[self.rows[name], columns] -= counts
+
+    def weightedCentroids(self):
+        """ Return the IDF weights and the unit-length TF-IDF centroids. """
+
+        idf = numpy.log((1.0 + self.noteCount) / (1.0 + self.df)) + 1.0
+        centroids = self.centroids * idf
+        norms = numpy.sqrt((centroids * centroids).sum(axis=1))
+        norms[norms == 0] = 1.0
+        return idf, centroids / norms[:, numpy.newaxis]
+
+    def score(self, noteids):
+        """ Return the cosine similarity of each note with each topic, as a
+            matrix with a row for each note and a column for each topic. """
+
+        idf, centroids = self.weightedCentroids()
+        scores = numpy.zeros((len(noteids), len(self.names)))
+
+        # Notes are scored a batch at a time to bound the size of the dense
+        # note matrix
+        for start in range(0, len(noteids), self.batchsize):
+            batch = noteids[start:start + self.batchsize]
+            notes = numpy.zeros((len(batch), self.dimension))
+            for row, noteid in enumerate(batch):
+                columns, counts = self.vector(noteid)
+                notes[row, columns] = counts
+            notes *= idf
+            norms = numpy.sqrt((notes * notes).sum(axis=1))
+            norms[norms == 0] = 1.0
+            notes /= norms[:, numpy.newaxis]
+            scores[start:start + len(batch)] = numpy.dot(notes, centroids.T)
+
+        return scores
+
+    def suggest(self, noteid, count=3):
+        """ Return up to count (score, topic name) pairs for the note, best
+            first. """
+
+        if len(self.names) == 0:
+            return []
+
+        scores = self.score([noteid])[0]
+        best = numpy.argsort(-scores)[:count]
+        return [(scores[i], self.names[i]) for i in best if scores[i] > 0]
+
+    def plan(self, noteids, threshold):
+        """ Return a dict mapping topic names to the notes whose best topic is
+            that topic with a score of at least threshold. """
+
+        assignments = defaultdict(list)
+        if len(self.names) == 0 or len(noteids) == 0:
+            return assignments
+
+        scores = self.score(noteids)
+        best = scores.argmax(axis=1)
+        for noteid, column, score in zip(noteids, best,
+                                         scores[numpy.arange(len(noteids)),
+                                                best]):
+            if score >= threshold:
+                assignments[self.names[column]].append(noteid)
+        return assignments
@@ -0,0 +1,351 @@
+"""
+ "  File: outlinerview.py
+ "  Written By: Gregory Owen
+ "
+ "  Views of the notes in a project: a virtualized display of the notes in a
+ "  topic, a window for searching notes, a palette for picking topics and a
+ "  window showing where time is being spent
+"""
+
+from Tkinter import *
+
+import dndlist
+
+def itemOf(dndlist, widget):
+    """ Return the id of the item on the canvas of dndlist that holds the
+        given widget, or None. """
+
+    canvas = dndlist.canvas
+    for item in canvas.find_all():
+        if (canvas.type(item) == 'window' and
+            canvas.itemcget(item, 'window') == str(widget)):
+            return item
+    return None
+
+
+class VirtualNoteList():
+    """ Displays a window of a topic's notes in a DNDList. Labels are only
+        created for the notes that fit on the canvas, and are relabelled with
+        other notes as the list is scrolled. """
+
+    def __init__(self, gui, topic, frame, width, height):
+        self.gui = gui
+        self.topic = topic
+        self.first = 0
+        self.size = height / gui.virtualRowHeight + 1
+
+        self.scrollbar = Scrollbar(frame, command=self.onScroll)
+        self.scrollbar.pack(side=RIGHT, fill=Y)
+
+        self.dndlist = dndlist.DNDList(frame, width, height)
+        self.dndlist.canvas.bind("<MouseWheel>", self.onWheel, add='+')
+        self.dndlist.canvas.bind("<Button-4>", self.onWheel, add='+')
+        self.dndlist.canvas.bind("<Button-5>", self.onWheel, add='+')
+
+        topic['dndlist'] = self.dndlist
+        self.show()
+
+    def sync(self):
+        """ Copy the order of the displayed notes, which may have been
+            rearranged by dragging, back into the topic's notes. """
+
+        ordered = [node.widget.noteid for node in self.dndlist.getOrdered()]
+        self.gui.model.reorderNotes(self.topic, ordered, self.first)
+
+    def show(self):
+        """ Relabel the displayed labels with the notes in the current window,
+            adding or removing labels if the window has changed size. """
+
+        notes = self.topic['notes']
+        self.first = max(0, min(self.first, len(notes) - self.size))
+        window = notes[self.first:self.first + self.size]
+        nodes = self.dndlist.getOrdered()
+
+        for node, noteid in zip(nodes, window):
+            node.widget.config(text=self.gui.model.noteText(noteid))
+            node.widget.noteid = noteid
+        for noteid in window[len(nodes):]:
+            self.addLabel(noteid)
+        for node in nodes[len(window):]:
+            self.dndlist.removeItem(self.itemId(node.widget))
+            self.gui.recycleLabel(node.widget)
+
+        if len(notes) > 0:
+            self.scrollbar.set(float(self.first) / len(notes),
+                               float(self.first + len(window)) / len(notes))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def refresh(self):
+        """ Redisplay the current window after the topic's notes have changed. """
+
+        self.sync()
+        self.show()
+
+    def addLabel(self, noteid):
+        """ Add a new label to the end of the DNDList. """
+
+        label = self.gui.addNoteLabel(self.topic, noteid)
+        label.bind("<MouseWheel>", self.onWheel, add='+')
+        label.bind("<Button-4>", self.onWheel, add='+')
+        label.bind("<Button-5>", self.onWheel, add='+')
+
+    def itemId(self, widget):
+        """ Return the id of the canvas item that holds the given widget. """
+
+        return itemOf(self.dndlist, widget)
+
+    def scrollTo(self, first):
+        """ Scroll the window so that it starts at the note at index first. """
+
+        self.sync()
+        self.first = first
+        self.show()
+
+    def onScroll(self, *args):
+        """ Scroll the window in response to the scrollbar. """
+
+        if args[0] == 'moveto':
+            self.scrollTo(int(float(args[1]) * len(self.topic['notes'])))
+        elif args[0] == 'scroll':
+            step = self.size - 1 if args[2] == 'pages' else 1
+            self.scrollTo(self.first + int(args[1]) * step)
+
+    def onWheel(self, event):
+        """ Scroll the window in response to the mouse wheel. """
+
+        if event.num == 4 or event.delta > 0:
+            self.scrollTo(self.first - 1)
+        else:
+            self.scrollTo(self.first + 1)
+
+
+class SearchWindow():
+    """ A window for searching the text of every note in the project and
+        jumping to the notes that match. """
+
+    def __init__(self, outliner, maxResults=500):
+        self.outliner = outliner
+        self.maxResults = maxResults
+        self.results = []
+
+        self.window = Toplevel(outliner.gui.root)
+        self.window.title("Search Notes")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+
+        self.query = StringVar()
+        entry = Entry(self.window, textvariable=self.query, width=60)
+        entry.pack(side=TOP, fill=X)
+        entry.bind("<Return>", self.onSearch)
+        entry.focus_set()
+
+        self.status = StringVar()
+        self.status.set("Words must all match. Use word* for prefixes and "
+                        "\"quotes\" for phrases.")
+        Label(self.window, textvariable=self.status).pack(side=BOTTOM, fill=X)
+
+        scrollbar = Scrollbar(self.window)
+        scrollbar.pack(side=RIGHT, fill=Y)
+        self.listbox = Listbox(self.window, width=80, height=20,
+                               yscrollcommand=scrollbar.set)
+        scrollbar.config(command=self.listbox.yview)
+        self.listbox.pack(side=LEFT, fill=BOTH, expand=True)
+        self.listbox.bind("<Double-Button-1>", self.onSelect)
+        self.listbox.bind("<Return>", self.onSelect)
+
+    def onSearch(self, event=None):
+        """ List the notes that match the query. """
+
+        model = self.outliner.model
+        index = model.searchIndex()
+        self.results = index.search(self.query.get())
+
+        self.listbox.delete(0, END)
+        for noteid in self.results[:self.maxResults]:
+            name = index.location.get(noteid)
+            self.listbox.insert(END, "[%s] %s" % (
+                name if name is not None else "Unassigned",
+                model.noteText(noteid)[:100]))
+
+        if len(self.results) > self.maxResults:
+            self.status.set("Showing the first %d of %d notes" %
+                            (self.maxResults, len(self.results)))
+        else:
+            self.status.set("%d notes" % len(self.results))
+
+    def onSelect(self, event=None):
+        """ Jump to the selected note. """
+
+        selection = self.listbox.curselection()
+        if len(selection) > 0:
+            self.outliner.showNote(self.results[int(selection[0])])
+
+    def lift(self):
+        """ Bring the window to the front. """
+
+        self.window.deiconify()
+        self.window.lift()
+
+    def close(self):
+        """ Close the window. """
+
+        self.outliner.searchWindow = None
+        self.window.destroy()
+
+
+class TopicPalette():
+    """ A window that lists the topics whose names match what has been typed
+        so far. Choosing a topic closes the window and calls choose with it. """
+
+    def __init__(self, outliner, title, choose, maxResults=50):
+        self.outliner = outliner
+        self.choose = choose
+        self.maxResults = maxResults
+        self.names = []
+
+        self.window = Toplevel(outliner.gui.root)
+        self.window.title(title)
+
+        self.query = StringVar()
+        entry = Entry(self.window, textvariable=self.query, width=40)
+        entry.pack(side=TOP, fill=X)
+        entry.bind("<KeyRelease>", self.onType)
+        entry.bind("<Return>", self.onChoose)
+        entry.bind("<Down>", lambda event: self.move(1))
+        entry.bind("<Up>", lambda event: self.move(-1))
+        entry.bind("<Escape>", lambda event: self.window.destroy())
+        entry.focus_set()
+
+        self.listbox = Listbox(self.window, width=40, height=15)
+        self.listbox.pack(side=TOP, fill=BOTH, expand=True)
+        self.listbox.bind("<Double-Button-1>", self.onChoose)
+
+        self.onType()
+
+    def onType(self, event=None):
+        """ List the topics that match the query. """
+
+        if event is not None and event.keysym in ("Up", "Down", "Return"):
+            return
+
+        topics = self.outliner.model.topics
+        index = self.outliner.gui.menu.topicIndex
+        self.names = [name for name in index.matches(self.query.get(),
+                                                     self.maxResults)
+                      if name in topics]
+
+        self.listbox.delete(0, END)
+        for name in self.names:
+            self.listbox.insert(END, name)
+        if len(self.names) > 0:
+            self.listbox.selection_set(0)
+
+    def move(self, step):
+        """ Move the selection up or down the list. """
+
+        selection = self.listbox.curselection()
+        current = int(selection[0]) if len(selection) > 0 else 0
+        i = max(0, min(len(self.names) - 1, current + step))
+        self.listbox.selection_clear(0, END)
+        self.listbox.selection_set(i)
+        self.listbox.see(i)
+
+    def onChoose(self, event=None):
+        """ Choose the selected topic. """
+
+        selection = self.listbox.curselection()
+        i = int(selection[0]) if len(selection) > 0 else 0
+        if i < len(self.names):
+            topic = self.outliner.model.topics[self.names[i]]
+            self.window.destroy()
+            self.choose(topic)
+
+
+class PerformanceWindow():
+    """ A window showing the calls recorded by the profiler, refreshed every
+        second, with buttons to start and stop recording and to save the
+        statistics. """
+
+    def __init__(self, outliner, profiler, interval=1000):
+        self.outliner = outliner
+        self.profiler = profiler
+        self.interval = interval
+
+        self.window = Toplevel(outliner.gui.root)
+        self.window.title("Performance")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+
+        buttons = Frame(self.window)
+        buttons.pack(side=TOP, fill=X)
+        self.recordButton = Button(buttons, command=self.toggle)
+        self.recordButton.pack(side=LEFT)
+        Button(buttons, text="Reset", command=self.reset).pack(side=LEFT)
+        Button(buttons, text="Save Stats", command=self.save).pack(side=LEFT)
+
+        self.status = StringVar()
+        Label(self.window, textvariable=self.status, anchor=W).pack(
+            side=BOTTOM, fill=X)
+
+        self.text = Text(self.window, width=90, height=25, font="TkFixedFont")
+        self.text.pack(side=TOP, fill=BOTH, expand=True)
+
+        self.refresh()
+
+    def refresh(self):
+        """ Redisplay the statistics, and schedule the next refresh. """
+
+        if self.profiler.enabled:
+            self.recordButton.config(text="Stop Recording")
+        else:
+            self.recordButton.config(text="Start Recording")
+
+        lines = ["%-36s %7s %10s %10s %8s %12s" % ("Method", "Calls",
+                                                   "Total (s)", "Max (s)",
+                                                   "Notes", "Bytes")]
+        for name, stat in self.profiler.rows():
+            lines.append("%-36s %7d %10.3f %10.3f %8s %12s" % (
+                name, stat['calls'], stat['seconds'], stat['max'],
+                stat.get('notes', ""), stat.get('bytes', "")))
+
+        self.text.config(state=NORMAL)
+        self.text.delete("1.0", END)
+        self.text.insert(END, "\n".join(lines))
+        self.text.config(state=DISABLED)
+
+        self.pending = self.window.after(self.interval, self.refresh)
+
+    def toggle(self):
+        """ Start or stop recording. """
+
+        if self.profiler.enabled:
+            self.profiler.stop()
+        else:
+            self.profiler.start(self.profiler.mode or 'stats',
+                                self.profiler.path)
+
+    def reset(self):
+        """ Clear the statistics. """
+
+        self.profiler.reset()
+        self.status.set("")
+
+    def save(self):
+        """ Write the statistics to the stats file. """
+
+        if self.profiler.mode is None:
+            self.status.set("Nothing has been recorded")
+        else:
+            self.status.set("Saved " + self.profiler.dump())
+
+    def lift(self):
+        """ Bring the window to the front. """
+
+        self.window.deiconify()
+        self.window.lift()
+
+    def close(self):
+        """ Close the window. """
+
+        self.window.after_cancel(self.pending)
+        self.outliner.performanceWindow = None
+        self.window.destroy()
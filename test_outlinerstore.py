@@ -0,0 +1,224 @@
+"""
+ "  File: test_outlinerstore.py
+ "  Written By: Gregory Owen
+ "
+ "  Checks the note lists against plain lists under random changes, and that
+ "  a project saved to its journal reopens as it was. Run with
+ "  python -m unittest test_outlinerstore
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from outlinermodel import OutlinerModel
+from outlinerstore import NoteList, NoteQueue
+
+class NoteListTest(unittest.TestCase):
+    """ A NoteList with small blocks, so that blocks are split and emptied
+        often, compared with a list. """
+
+    def check(self, notes, expected):
+        self.assertEqual(list(notes), expected)
+        self.assertEqual(len(notes), len(expected))
+        for position, noteid in enumerate(expected):
+            self.assertEqual(notes[position], noteid)
+            self.assertEqual(notes.index(noteid), position)
+            self.assertTrue(noteid in notes)
+        self.assertFalse(-1 in notes)
+
+    def testRandomChanges(self):
+        rand = random.Random(1)
+        expected = range(50)
+        notes = NoteList(expected, blockSize=4)
+        expected = list(expected)
+        nextId = 50
+
+        for step in range(2000):
+            op = rand.choice(['append', 'remove', 'pop', 'move', 'replace',
+                              'insert'])
+            if op == 'append':
+                notes.append(nextId)
+                expected.append(nextId)
+                nextId += 1
+            elif op == 'insert':
+                position = rand.randint(0, len(expected))
+                notes.insert(position, nextId)
+                expected.insert(position, nextId)
+                nextId += 1
+            elif len(expected) == 0:
+                continue
+            elif op == 'remove':
+                noteid = rand.choice(expected)
+                notes.remove(noteid)
+                expected.remove(noteid)
+            elif op == 'pop':
+                position = rand.randrange(len(expected))
+                self.assertEqual(notes.pop(position), expected.pop(position))
+            elif op == 'move':
+                noteid = rand.choice(expected)
+                position = rand.randrange(len(expected))
+                notes.move(noteid, position)
+                expected.remove(noteid)
+                expected.insert(position, noteid)
+            else:
+                start = rand.randrange(len(expected))
+                count = rand.randint(0, len(expected) - start)
+                window = expected[start:start + count]
+                rand.shuffle(window)
+                notes.replace(start, window)
+                expected[start:start + count] = window
+
+            self.assertEqual(list(notes), expected)
+            self.assertEqual(notes[2:9], expected[2:9])
+
+        self.check(notes, expected)
+
+
+class NoteQueueTest(unittest.TestCase):
+    """ A NoteQueue with small blocks compared with a list of its stored notes
+        and the position of the current note. """
+
+    def check(self, queue, stored, cursor):
+        self.assertEqual(queue.stored(), stored)
+        self.assertEqual(queue.position(), cursor)
+        self.assertEqual(list(queue), stored[cursor:] + stored[:cursor])
+        for index in range(len(stored)):
+            self.assertEqual(queue[index],
+                             stored[(cursor + index) % len(stored)])
+
+    def testRandomChanges(self):
+        rand = random.Random(2)
+        stored = range(40)
+        queue = NoteQueue(stored, blockSize=4)
+        stored = list(stored)
+        cursor = 0
+        nextId = 40
+
+        for step in range(2000):
+            op = rand.choice(['rotate', 'popleft', 'appendleft', 'append',
+                              'insertAt', 'removeNotes', 'removeAt',
+                              'moveTo', 'find'])
+            if op == 'appendleft':
+                queue.appendleft(nextId)
+                stored.insert(cursor, nextId)
+                nextId += 1
+            elif op == 'append':
+                queue.append(nextId)
+                if cursor == 0:
+                    stored.append(nextId)
+                else:
+                    stored.insert(cursor, nextId)
+                    cursor += 1
+                nextId += 1
+            elif op == 'insertAt':
+                position = rand.randint(0, len(stored))
+                queue.insertAt(position, nextId)
+                stored.insert(position, nextId)
+                if len(stored) > 1 and position <= cursor:
+                    cursor += 1
+                nextId += 1
+            elif len(stored) == 0:
+                continue
+            elif op == 'rotate':
+                steps = rand.randint(-5, 5)
+                queue.rotate(steps)
+                cursor = (cursor - steps) % len(stored)
+            elif op == 'moveTo':
+                position = rand.randrange(len(stored) * 2)
+                queue.moveTo(position)
+                cursor = position % len(stored)
+            elif op == 'popleft':
+                self.assertEqual(queue.popleft(), stored.pop(cursor))
+                if cursor == len(stored):
+                    cursor = 0
+            elif op == 'find':
+                noteid = rand.choice(stored)
+                self.assertEqual(queue.find(noteid), stored.index(noteid))
+                self.assertEqual(queue.find(-1), None)
+            else:
+                count = rand.randint(1, min(5, len(stored)))
+                noteids = rand.sample(stored, count)
+                positions = None
+                if op == 'removeAt':
+                    found = queue.positions(noteids)
+                    positions = [found[noteid] for noteid in noteids]
+                    self.assertEqual(positions,
+                                     [stored.index(noteid)
+                                      for noteid in noteids])
+                queue.removeNotes(noteids, positions)
+
+                # The first note kept from the current note on becomes the
+                # current note
+                before = len([noteid for noteid in stored[:cursor]
+                              if noteid not in noteids])
+                stored = [noteid for noteid in stored
+                          if noteid not in noteids]
+                cursor = before if before < len(stored) else 0
+
+            self.check(queue, stored, cursor)
+
+
+class JournalTest(unittest.TestCase):
+    """ Changes saved to the journal of a project are there when it is
+        opened again. """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix="outlinertest")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def state(self, model):
+        """ Return the texts of the unassigned notes, from the current note,
+            and of the topics, in the order of the outline. """
+
+        for topic in model.topics.values():
+            model.loadTopic(topic)
+        return ([model.noteText(noteid) for noteid in model.notes],
+                [(topic['name'], [model.noteText(noteid)
+                                  for noteid in topic['notes']])
+                 for topic in model.orderedTopics()])
+
+    def testReopen(self):
+        notepath = os.path.join(self.folder, "notes.txt")
+        notefile = open(notepath, 'w')
+        notefile.write("\n\n".join("note %d" % i for i in range(30)) + "\n\n")
+        notefile.close()
+
+        model = OutlinerModel(None)
+        model.newModel(notepath)
+        model.filename = os.path.join(self.folder, "project.otln")
+        model.newTopic("first")
+        model.newTopic("second")
+        model.saveModel()
+
+        first, second = model.topics["first"], model.topics["second"]
+        model.addNoteToTopic(first)
+        model.nextNote()
+        model.nextNote()
+        model.addNoteToTopic(second)
+        model.assignNotes(first, list(model.notes)[3:7])
+        model.discardNotes(list(model.notes)[:2])
+        model.moveNote(first, first['notes'][4], 0)
+        model.removeNoteFromTopic(first, first['notes'][2])
+        model.moveTopic(second, 0)
+        model.prevNote()
+        model.undo()
+        model.undo()
+        model.redo()
+
+        save = model.prepareSave()
+        self.assertEqual(save['kind'], 'journal')
+        model.writeSave(save)
+        self.assertTrue(os.path.exists(model.filename + ".journal"))
+
+        reopened = OutlinerModel(None)
+        reopened.openModel(model.filename)
+        self.assertEqual(self.state(reopened), self.state(model))
+
+
+if __name__ == '__main__':
+    unittest.main()